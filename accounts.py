@@ -0,0 +1,70 @@
+import imaplib
+
+from imap_pool import IMAPPool
+from imap_utils import refresh_capabilities
+from mail_sync import enable_qresync
+
+# 邮箱账号：[EMAIL] 是第一个账号，其他账号每个写一个 [ACCOUNT 名称] 小节，字段和 [EMAIL] 一样：
+#
+#   [ACCOUNT 学院]
+#   IMAP_SERVER = mail.dept.example.edu.cn
+#   EMAIL_ACCOUNT = me@dept.example.edu.cn
+#   EMAIL_PASSWORD = xxxxxxxx
+#   FOLDERS = inbox, Junk
+#
+# FOLDERS 是要加载的文件夹，逗号分隔，默认只有 inbox；每个账号有自己的连接池，不同账号同时加载
+
+
+def split_folders(value):
+    return [folder.strip() for folder in (value or "").split(",") if folder.strip()]
+
+
+class MailAccount:
+    def __init__(self, name, server, user, password, use_ssl=True, port=None, folders=None, pool_size=2,
+                 keepalive=240):
+        self.name = name
+        self.server = server
+        self.user = user
+        self.password = password
+        self.use_ssl = use_ssl
+        self.port = port or (993 if use_ssl else 143)
+        self.folders = list(folders or ["inbox"])
+        self.pool = IMAPPool(self.connect, pool_size, keepalive)
+
+    @classmethod
+    def from_section(cls, name, options, pool_size=2, keepalive=240):
+        return cls(
+            name,
+            options['IMAP_SERVER'],
+            options['EMAIL_ACCOUNT'],
+            options['EMAIL_PASSWORD'],
+            use_ssl=options.getboolean('IMAP_SSL', fallback=True),
+            port=options.getint('IMAP_PORT', fallback=None),
+            folders=split_folders(options.get('FOLDERS', fallback='inbox')),
+            pool_size=options.getint('POOL_SIZE', fallback=pool_size),
+            keepalive=options.getint('KEEPALIVE', fallback=keepalive),
+        )
+
+    # 连接并登录，取得登录后的能力列表，服务器支持时启用 QRESYNC
+    def connect(self):
+        if self.use_ssl:
+            mail = imaplib.IMAP4_SSL(self.server, self.port)
+        else:
+            mail = imaplib.IMAP4(self.server, self.port)
+        _, response = mail.login(self.user, self.password)
+        refresh_capabilities(mail, response)
+        enable_qresync(mail)
+        return mail
+
+    def close(self):
+        self.pool.close()
+
+
+# 读取所有账号，第一个是 [EMAIL]
+def load_mail_accounts(config, pool_size=2, keepalive=240):
+    accounts = [MailAccount.from_section('EMAIL', config['EMAIL'], pool_size, keepalive)]
+    for section in config.sections():
+        if section.upper().startswith("ACCOUNT "):
+            accounts.append(MailAccount.from_section(section[len("ACCOUNT "):].strip(), config[section],
+                                                     pool_size, keepalive))
+    return accounts
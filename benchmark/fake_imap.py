@@ -0,0 +1,336 @@
+import email
+import random
+import re
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime, parsedate_to_datetime
+
+# 本地的 IMAP 替身，只实现本程序用到的命令：LOGIN、CAPABILITY、ENABLE、SELECT、STATUS、UID SEARCH、UID FETCH、NOOP、LOGOUT
+# 邮件放在内存里，每条命令可以加上固定延迟来模拟网络往返
+
+# 和大多数真实服务器一样，CONDSTORE、ENABLE 这些扩展登录之后才列出来
+PREAUTH_CAPABILITIES = "IMAP4rev1 AUTH=PLAIN"
+CAPABILITIES = "IMAP4rev1 CONDSTORE ENABLE UIDPLUS"
+
+SUBJECTS = ["关于{}的通知", "{}讲座预告", "【重要】{}安排调整", "Re: {}相关问题", "{} weekly newsletter", "{}报名截止提醒"]
+TOPICS = ["期末考试", "学术论坛", "宿舍施工", "奖学金评审", "选课", "图书馆", "体育赛事", "实验室安全"]
+SENTENCES = [
+    "请各位同学于本周五前完成相关材料的提交。",
+    "活动地点在第一教学楼报告厅，欢迎感兴趣的同学参加。",
+    "因天气原因，原定课程调整到下周同一时间。",
+    "Please find the agenda for next week's seminar below.",
+    "如有疑问请回复本邮件或联系教务办公室。",
+    "This is an automated reminder, please do not reply.",
+]
+
+
+def _quote(value):
+    if value is None:
+        return "NIL"
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+# 生成 BODYSTRUCTURE 响应
+def bodystructure(part):
+    if part.is_multipart():
+        children = "".join(bodystructure(child) for child in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype().upper())})"
+
+    maintype, subtype = part.get_content_maintype(), part.get_content_subtype()
+    params = (part.get_params() or [])[1:]
+    params_text = "(" + " ".join(f"{_quote(k)} {_quote(v)}" for k, v in params) + ")" if params else "NIL"
+    payload = _part_bytes(part)
+    encoding = (part.get("Content-Transfer-Encoding") or "7bit").upper()
+    disposition = part.get_content_disposition()
+    disposition_text = f"({_quote(disposition)} NIL)" if disposition else "NIL"
+    text = f"({_quote(maintype.upper())} {_quote(subtype.upper())} {params_text} NIL NIL {_quote(encoding)} {len(payload)}"
+    if maintype == "text":
+        # text 类型多一个行数字段
+        text += " " + str(payload.count(b"\n"))
+    return text + f" NIL {disposition_text} NIL)"
+
+def _part_bytes(part):
+    payload = part.get_payload()
+    if isinstance(payload, list):
+        return b""
+    return payload.encode("utf-8", "surrogateescape") if isinstance(payload, str) else bytes(payload)
+
+# BODY[1.2] 这种部件编号对应的原始内容
+def _section(msg, spec):
+    part = msg
+    for number in spec.split("."):
+        number = int(number)
+        if part.is_multipart():
+            part = part.get_payload()[number - 1]
+        elif number != 1:
+            return b""
+    return b"" if part.is_multipart() else _part_bytes(part)
+
+
+# 生成合成邮件：attachment_ratio 比例的邮件带附件，html_ratio 比例的邮件同时有 HTML 正文，charset 从 charsets 里轮流选
+# id_prefix 用来区分不同账号、文件夹的邮件，Message-ID 相同的邮件会被当成同一封去重
+def make_corpus(count, attachment_ratio=0.2, attachment_size=200_000, html_ratio=0.5,
+                charsets=("utf-8",), seed=0, id_prefix="bench", reply_ratio=0.0):
+    rng = random.Random(seed)
+    start = datetime(2024, 11, 1, 8, 0)
+    messages = []
+    # 已生成邮件的 (主题, Message-ID, References, 正文)，回复邮件从最近的几封里选一封来回复
+    sent = []
+    for i in range(1, count + 1):
+        topic = rng.choice(TOPICS)
+        charset = charsets[i % len(charsets)]
+        msg = EmailMessage()
+        msg["From"] = f"Sender {i % 97} <sender{i % 97}@example.edu.cn>"
+        msg["To"] = "me@example.edu.cn"
+        msg["Date"] = format_datetime((start + timedelta(minutes=17 * i)).astimezone())
+        message_id = f"<{id_prefix}-{i}@example.edu.cn>"
+        msg["Message-ID"] = message_id
+        if i % 5 == 0:
+            msg["List-Id"] = "<news.example.edu.cn>"
+
+        # 每封邮件的正文都不一样，避免内容指纹缓存把分类请求合并掉
+        body = f"{topic} 第 {i} 号通知\n\n" + "\n".join(rng.choice(SENTENCES) for _ in range(rng.randint(3, 12)))
+        if sent and rng.random() < reply_ratio:
+            # 回复：带 In-Reply-To / References，正文后面引用被回复的邮件
+            subject, parent_id, references, parent_body = rng.choice(sent[-20:])
+            references = f"{references} {parent_id}".strip()
+            msg["Subject"] = subject if subject.startswith("Re: ") else f"Re: {subject}"
+            msg["In-Reply-To"] = parent_id
+            msg["References"] = references
+            body = f"收到，第 {i} 号回复：{rng.choice(SENTENCES)}\n\n-----原始邮件-----\n{parent_body}"
+        else:
+            msg["Subject"] = rng.choice(SUBJECTS).format(topic) + f" #{i}"
+            references = ""
+        sent.append((msg["Subject"], message_id, references, body))
+        try:
+            body.encode(charset)
+        except UnicodeEncodeError:
+            charset = "utf-8"
+        msg.set_content(body, charset=charset)
+        if rng.random() < html_ratio:
+            html = "<html><body>" + "".join(f"<p>{line}</p>" for line in body.splitlines()) + "</body></html>"
+            msg.add_alternative(html, subtype="html", charset=charset)
+        if rng.random() < attachment_ratio:
+            # 和 Random.randbytes 生成的内容相同，但 Python 3.9 以前也能用
+            data = rng.getrandbits(attachment_size * 8).to_bytes(attachment_size, "little") if attachment_size else b""
+            msg.add_attachment(data, maintype="application", subtype="pdf",
+                               filename=f"attachment-{i}.pdf")
+        messages.append(msg.as_bytes())
+    return messages
+
+
+class Mailbox:
+    def __init__(self, messages, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.lock = threading.Lock()
+        # {uid: 原始邮件}
+        self.messages = {}
+        self.flags = {}
+        self.modseq = {}
+        self.highestmodseq = 1
+        self.uidnext = 1
+        for raw in messages:
+            self.append(raw)
+
+    def append(self, raw):
+        with self.lock:
+            uid = self.uidnext
+            self.uidnext += 1
+            self.highestmodseq += 1
+            self.messages[uid] = raw
+            self.flags[uid] = set()
+            self.modseq[uid] = self.highestmodseq
+        return uid
+
+    def parsed(self, uid):
+        return email.message_from_bytes(self.messages[uid])
+
+
+class IMAPHandler(socketserver.StreamRequestHandler):
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def handle(self):
+        self.mailbox = None
+        self.authenticated = False
+        self.send(f"* OK [CAPABILITY {PREAUTH_CAPABILITIES}] fake IMAP ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.decode(errors="replace").rstrip("\r\n").partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            if command == "UID":
+                subcommand, _, args = args.partition(" ")
+                command = f"UID_{subcommand.upper()}"
+
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            self.server.count(command)
+            handler = getattr(self, f"do_{command}", None)
+            if handler is None:
+                self.send(f"{tag} BAD unsupported command\r\n")
+            elif handler(tag, args) is False:
+                return
+
+    def do_CAPABILITY(self, tag, args):
+        capabilities = CAPABILITIES if self.authenticated else PREAUTH_CAPABILITIES
+        self.send(f"* CAPABILITY {capabilities}\r\n{tag} OK done\r\n")
+
+    # LOGIN 响应里不带 [CAPABILITY ...]，客户端需要自己再问一次
+    def do_LOGIN(self, tag, args):
+        self.authenticated = True
+        self.send(f"{tag} OK LOGIN completed\r\n")
+
+    def do_ENABLE(self, tag, args):
+        self.send(f"* ENABLED\r\n{tag} OK done\r\n")
+
+    def do_NOOP(self, tag, args):
+        self.send(f"{tag} OK done\r\n")
+
+    def do_LOGOUT(self, tag, args):
+        self.send(f"* BYE\r\n{tag} OK done\r\n")
+        return False
+
+    def do_SELECT(self, tag, args):
+        self.mailbox = self.server.mailboxes.get(args.split(" ")[0].strip('"').lower())
+        if self.mailbox is None:
+            self.send(f"{tag} NO no such mailbox\r\n")
+            return
+        box = self.mailbox
+        self.send(f"* {len(box.messages)} EXISTS\r\n* 0 RECENT\r\n"
+                  f"* OK [UIDVALIDITY {box.uidvalidity}] UIDs valid\r\n* OK [UIDNEXT {box.uidnext}] next UID\r\n"
+                  f"* OK [HIGHESTMODSEQ {box.highestmodseq}] modseq\r\n{tag} OK [READ-WRITE] SELECT completed\r\n")
+
+    do_EXAMINE = do_SELECT
+
+    def do_STATUS(self, tag, args):
+        name = args.split(" ")[0].strip('"')
+        box = self.server.mailboxes.get(name.lower())
+        if box is None:
+            self.send(f"{tag} NO no such mailbox\r\n")
+            return
+        values = {"MESSAGES": len(box.messages), "UIDNEXT": box.uidnext,
+                  "UIDVALIDITY": box.uidvalidity, "HIGHESTMODSEQ": box.highestmodseq}
+        items = [item for item in re.findall(r"[A-Z]+", args.upper()) if item in values]
+        self.send(f"* STATUS {name} (" + " ".join(f"{item} {values[item]}" for item in items) + f")\r\n{tag} OK done\r\n")
+
+    # 解析 UID 序列集，* 表示最大的 UID
+    def uid_set(self, spec):
+        uids = sorted(self.mailbox.messages)
+        largest = uids[-1] if uids else 0
+        selected = set()
+        for item in spec.split(","):
+            lo, _, hi = item.partition(":")
+            lo = largest if lo == "*" else int(lo)
+            hi = lo if not hi else largest if hi == "*" else int(hi)
+            lo, hi = min(lo, hi), max(lo, hi)
+            selected.update(uid for uid in uids if lo <= uid <= hi)
+        return sorted(selected)
+
+    def do_UID_SEARCH(self, tag, args):
+        tokens = args.split()
+        matches = sorted(self.mailbox.messages)
+        i = 0
+        while i < len(tokens):
+            key = tokens[i].upper()
+            if key in ("SINCE", "BEFORE"):
+                day = datetime.strptime(tokens[i + 1], "%d-%b-%Y").date()
+                dates = {uid: parsedate_to_datetime(self.mailbox.parsed(uid)["Date"]).date() for uid in matches}
+                matches = [uid for uid in matches if (dates[uid] >= day if key == "SINCE" else dates[uid] < day)]
+                i += 1
+            elif key == "UID":
+                selected = set(self.uid_set(tokens[i + 1]))
+                matches = [uid for uid in matches if uid in selected]
+                i += 1
+            i += 1
+        self.send("* SEARCH" + "".join(f" {uid}" for uid in matches) + f"\r\n{tag} OK SEARCH completed\r\n")
+
+    def do_UID_FETCH(self, tag, args):
+        box = self.mailbox
+        spec, _, items = args.partition(" ")
+        changed_since = re.search(r"\(CHANGEDSINCE (\d+)[^)]*\)\s*$", items)
+        if changed_since:
+            items = items[:changed_since.start()]
+            changed_since = int(changed_since.group(1))
+        items = items.strip()
+        if items.startswith("("):
+            items = items[1:-1]
+        all_uids = sorted(box.messages)
+
+        for uid in self.uid_set(spec):
+            if changed_since is not None and box.modseq[uid] <= changed_since:
+                continue
+            raw = box.messages[uid]
+            msg = email.message_from_bytes(raw)
+            parts = [f"UID {uid}".encode()]
+            for item in re.findall(r"BODY(?:\.PEEK)?\[[^\]]*\](?:<[\d.]+>)?|\S+", items):
+                name = item.upper()
+                if name == "UID":
+                    continue
+                if name == "FLAGS":
+                    parts.append(f"FLAGS ({' '.join(sorted(box.flags[uid]))})".encode())
+                elif name == "MODSEQ":
+                    parts.append(f"MODSEQ ({box.modseq[uid]})".encode())
+                elif name == "RFC822.SIZE":
+                    parts.append(f"RFC822.SIZE {len(raw)}".encode())
+                elif name == "BODYSTRUCTURE":
+                    parts.append(f"BODYSTRUCTURE {bodystructure(msg)}".encode())
+                elif name in ("RFC822", "BODY[]", "BODY.PEEK[]"):
+                    label = "BODY[]" if name == "BODY.PEEK[]" else name
+                    parts.append(f"{label} {{{len(raw)}}}\r\n".encode() + raw)
+                elif name.startswith("BODY"):
+                    parts.append(self.fetch_section(item, raw, msg))
+            self.send(f"* {all_uids.index(uid) + 1} FETCH (".encode() + b" ".join(parts) + b")\r\n")
+        self.send(f"{tag} OK FETCH completed\r\n")
+
+    # BODY.PEEK[HEADER.FIELDS (...)]、BODY.PEEK[1]<0.16384> 这类数据项
+    def fetch_section(self, item, raw, msg):
+        match = re.match(r"BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?", item, re.IGNORECASE)
+        section = match.group(1)
+        if section.upper().startswith("HEADER.FIELDS"):
+            fields = set(re.findall(r"[\w-]+", section[len("HEADER.FIELDS"):].upper()))
+            data = b"".join(f"{key}: {value}\r\n".encode("utf-8", "surrogateescape")
+                            for key, value in msg.items() if key.upper() in fields) + b"\r\n"
+        elif section.upper() == "HEADER":
+            data = raw.split(b"\n\n", 1)[0] + b"\n\n"
+        else:
+            data = _section(msg, section)
+
+        label = f"BODY[{section}]"
+        if match.group(2):
+            offset, length = int(match.group(2)), int(match.group(3))
+            data = data[offset:offset + length]
+            label += f"<{offset}>"
+        return f"{label} {{{len(data)}}}\r\n".encode() + data
+
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, mailboxes, latency=0.0, host="127.0.0.1", port=0):
+        super().__init__((host, port), IMAPHandler)
+        self.mailboxes = {name.lower(): box for name, box in mailboxes.items()}
+        self.latency = latency
+        self.commands = {}
+        self.commands_lock = threading.Lock()
+
+    def count(self, command):
+        with self.commands_lock:
+            self.commands[command] = self.commands.get(command, 0) + 1
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    # 在后台线程里运行，返回自身
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
@@ -0,0 +1,164 @@
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 兼容 OpenAI 接口的本地替身，只实现 POST .../chat/completions
+# 每个请求按 latency ± jitter 秒延迟后返回，超过每分钟请求数 rpm 时返回 429，和真实服务一样带 Retry-After
+# 回复内容由邮件内容的哈希决定，同一封邮件每次的分类结果相同
+# 请求带 stream=True 时按 SSE 分块返回：第一块在延迟的 FIRST_CHUNK_SHARE 之后到达，其余均匀分布在剩下的时间里
+
+TYPES = ["教务通知", "活动宣传", "学术讲座", "生活服务", "系统通知"]
+PRIORITIES = ["必须完成", "重要通知", "一般通知", "一般通知", "一般通知", "回复必要"]
+_BATCH_ID = re.compile(r"^=== 邮件 (\S+) ===$", re.MULTILINE)
+FIRST_CHUNK_SHARE = 0.3
+# 流式回复每块的字符数
+CHUNK_CHARS = 8
+
+
+def _pick(options, text):
+    return options[zlib.crc32(text.encode("utf-8")) % len(options)]
+
+def _classification(text):
+    return {
+        "类型": _pick(TYPES, text),
+        "重要级": _pick(PRIORITIES, text[::-1]),
+        "发件人": "sender@example.edu.cn",
+        "收件人": "me@example.edu.cn",
+        "总结": text.strip().splitlines()[0][:40] if text.strip() else "",
+        "日程": "",
+    }
+
+# 按请求内容生成回复：批量分类（response_format 为 json_object）返回 JSON，其余返回逐行的 "字段: 值"
+def make_reply(request):
+    content = "\n".join(message.get("content", "") for message in request.get("messages", [])
+                        if message.get("role") == "user")
+    if (request.get("response_format") or {}).get("type") == "json_object":
+        chunks = _BATCH_ID.split(content)
+        # split 之后是 [前缀, id1, 内容1, id2, 内容2, ...]
+        results = [dict(_classification(text), id=email_id) for email_id, text in zip(chunks[1::2], chunks[2::2])]
+        return json.dumps({"results": results}, ensure_ascii=False)
+    info = _classification(content)
+    return "\n".join(f"{key}: {value}" for key, value in info.items())
+
+
+class OpenAIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+
+        server = self.server
+        if not server.admit():
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                           "code": "rate_limit_exceeded"}}, {"Retry-After": "1"})
+            return
+
+        latency = max(0.0, server.latency + random.uniform(-server.jitter, server.jitter))
+        reply = make_reply(request)
+        prompt_tokens = sum(len(message.get("content", "")) for message in request.get("messages", [])) // 2
+        completion_tokens = len(reply) // 2
+        if request.get("stream"):
+            self.send_stream(request, reply, latency, prompt_tokens, completion_tokens)
+            server.record(prompt_tokens, completion_tokens)
+            return
+
+        time.sleep(latency)
+        server.record(prompt_tokens, completion_tokens)
+        self.send_json(200, {
+            "id": f"chatcmpl-bench-{server.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def send_stream(self, request, reply, latency, prompt_tokens, completion_tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        chunks = [reply[i:i + CHUNK_CHARS] for i in range(0, len(reply), CHUNK_CHARS)] or [""]
+        base = {"id": f"chatcmpl-bench-{self.server.requests}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": request.get("model", "fake")}
+
+        def send_event(body):
+            self.wfile.write(f"data: {json.dumps(body, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        time.sleep(latency * FIRST_CHUNK_SHARE)
+        for i, text in enumerate(chunks):
+            if i:
+                time.sleep(latency * (1 - FIRST_CHUNK_SHARE) / len(chunks))
+            send_event(dict(base, choices=[{"index": 0, "delta": {"content": text}, "finish_reason": None}]))
+        send_event(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send_event(dict(base, choices=[], usage={"prompt_tokens": prompt_tokens,
+                                                     "completion_tokens": completion_tokens,
+                                                     "total_tokens": prompt_tokens + completion_tokens}))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.5, jitter=0.2, rpm=0, host="127.0.0.1", port=0):
+        super().__init__((host, port), OpenAIHandler)
+        self.latency = latency
+        self.jitter = min(jitter, latency)
+        self.rpm = rpm
+        self.lock = threading.Lock()
+        # 最近一分钟内接受的请求时间
+        self.recent = deque()
+        self.requests = 0
+        self.rate_limited = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    # 按每分钟请求数限流，返回是否接受这个请求
+    def admit(self):
+        with self.lock:
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] >= 60:
+                self.recent.popleft()
+            if self.rpm and len(self.recent) >= self.rpm:
+                self.rate_limited += 1
+                return False
+            self.recent.append(now)
+            return True
+
+    def record(self, prompt_tokens, completion_tokens):
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    # 在后台线程里运行，返回自身
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_imap import FakeIMAPServer, Mailbox, make_corpus
+from fake_openai import FakeOpenAIServer
+
+# 端到端基准测试：启动本地的 IMAP 替身和 OpenAI 接口替身，跑一遍 拉取 → 分类 → 表格数据更新，
+# 输出吞吐量（封/秒）、各阶段延迟的 p50/p95/p99 和峰值内存，作为性能改动前后对比的基准
+#
+#   python benchmark/run_benchmark.py --emails 500 --llm-latency 0.8 --workers 16
+#   python benchmark/run_benchmark.py --emails 2000 --batch-size 8 --json result.json
+#   python benchmark/run_benchmark.py --emails 200 --accounts 3 --folders inbox,junk   # 每个账号的每个文件夹各 200 封
+#   python benchmark/run_benchmark.py --emails 500 --reply-ratio 0.5 [--no-threads]     # 一半是回复，对比会话分组
+#
+# 不需要真实邮箱和 API key；会在临时目录里生成 .config，程序本身的配置文件不受影响
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="邮件助手端到端基准测试")
+    parser.add_argument("--emails", type=int, default=300, help="每个文件夹的合成邮件数量")
+    parser.add_argument("--accounts", type=int, default=1, help="账号数，每个账号一个 IMAP 替身")
+    parser.add_argument("--folders", default="inbox", help="每个账号加载的文件夹，逗号分隔")
+    parser.add_argument("--attachment-ratio", type=float, default=0.2, help="带附件邮件的比例")
+    parser.add_argument("--attachment-size", type=int, default=200_000, help="附件大小（字节）")
+    parser.add_argument("--html-ratio", type=float, default=0.5, help="同时带 HTML 正文的邮件比例")
+    parser.add_argument("--reply-ratio", type=float, default=0.0, help="回复邮件（带 In-Reply-To/References）的比例")
+    parser.add_argument("--charsets", default="utf-8,gb2312,gbk,big5", help="邮件编码，逗号分隔，轮流使用")
+    parser.add_argument("--imap-latency", type=float, default=0.02, help="每条 IMAP 命令的延迟（秒）")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="每个 API 请求的平均延迟（秒）")
+    parser.add_argument("--llm-jitter", type=float, default=0.2, help="API 延迟的随机浮动（秒）")
+    parser.add_argument("--llm-rpm", type=int, default=0, help="API 每分钟请求数上限，超过返回 429，0 表示不限制")
+    parser.add_argument("--workers", type=int, default=8, help="[OPENAI] WORKERS")
+    parser.add_argument("--batch-size", type=int, default=1, help="[OPENAI] BATCH_SIZE")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="[OPENAI] STREAM = false")
+    parser.add_argument("--no-threads", dest="threads", action="store_false", help="[EMAIL] GROUP_THREADS = false")
+    parser.add_argument("--fetch-mode", default="partial", choices=("partial", "full"), help="[EMAIL] FETCH_MODE")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="把结果另外写入这个 JSON 文件")
+    args = parser.parse_args(argv)
+    # 之后会切换到临时目录，先把输出路径转成绝对路径
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    return args
+
+# 在临时目录里写一份指向本地替身的 .config，之后在这个目录里导入 main；第一个账号写在 [EMAIL]，其余的写成 [ACCOUNT n]
+def write_config(directory, args, imap_ports, openai_url):
+    accounts = "".join(f"""
+[ACCOUNT {i}]
+IMAP_SERVER = 127.0.0.1
+IMAP_PORT = {port}
+IMAP_SSL = false
+EMAIL_ACCOUNT = bench{i}@example.edu.cn
+EMAIL_PASSWORD = bench
+FOLDERS = {args.folders}
+""" for i, port in enumerate(imap_ports[1:], 1))
+    with open(os.path.join(directory, ".config"), "w", encoding="utf-8") as f:
+        f.write(f"""[EMAIL]
+IMAP_SERVER = 127.0.0.1
+IMAP_PORT = {imap_ports[0]}
+IMAP_SSL = false
+EMAIL_ACCOUNT = bench@example.edu.cn
+EMAIL_PASSWORD = bench
+FOLDERS = {args.folders}
+FETCH_MODE = {args.fetch_mode}
+GROUP_THREADS = {str(args.threads).lower()}
+INCREMENTAL_SYNC = false
+
+[OPENAI]
+API_KEY = sk-bench
+BASE_URL = {openai_url}
+WORKERS = {args.workers}
+BATCH_SIZE = {args.batch_size}
+STREAM = {str(args.stream).lower()}
+REQUESTS_PER_MINUTE = 0
+TOKENS_PER_MINUTE = 0
+
+[CACHE]
+ENABLED = false
+
+[RULES]
+ENABLED = false
+
+[LOCAL_MODEL]
+ENABLED = false
+{accounts}""")
+
+
+# 按阶段收集延迟样本（秒）
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    # 包装一个函数，每次调用的耗时记到 stage 里
+    def timed(self, stage, func):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+        return wrapper
+
+    def summary(self):
+        with self.lock:
+            return {stage: summarize(values) for stage, values in self.samples.items()}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": values[-1] * 1000 if values else 0.0,
+    }
+
+# 进程的峰值内存（MB），Windows 上没有 resource 模块时返回 None
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位是 KB，macOS 上是字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run(args):
+    charsets = [charset.strip() for charset in args.charsets.split(",") if charset.strip()]
+    folders = [folder.strip() for folder in args.folders.split(",") if folder.strip()]
+    accounts = max(1, args.accounts)
+    print(f"generating {args.emails * len(folders) * accounts} emails ...", file=sys.stderr)
+    imap_servers = []
+    for account in range(accounts):
+        mailboxes = {}
+        for i, folder in enumerate(folders):
+            corpus = make_corpus(args.emails, args.attachment_ratio, args.attachment_size, args.html_ratio, charsets,
+                                 args.seed + account * len(folders) + i, id_prefix=f"bench{account}-{folder}",
+                                 reply_ratio=args.reply_ratio)
+            mailboxes[folder] = Mailbox(corpus)
+        imap_servers.append(FakeIMAPServer(mailboxes, latency=args.imap_latency).start())
+    openai_server = FakeOpenAIServer(args.llm_latency, args.llm_jitter, args.llm_rpm).start()
+
+    workdir = tempfile.mkdtemp(prefix="mail-bench-")
+    write_config(workdir, args, [server.port for server in imap_servers], openai_server.base_url)
+    os.chdir(workdir)
+
+    import main
+    from table_model import TableModel
+
+    recorder = Recorder()
+    # IMAP 每条 UID 命令的往返，以及每封邮件的 MIME 解析
+    def timed_connect(mail_account):
+        def connect():
+            mail = mail_account.connect()
+            mail.uid = recorder.timed("imap_command", mail.uid)
+            return mail
+        return connect
+    for mail_account in main.mail_accounts:
+        mail_account.pool.connect = timed_connect(mail_account)
+    main.extract_email_headers = recorder.timed("parse_headers", main.extract_email_headers)
+    main.extract_email_content = recorder.timed("parse_content", main.extract_email_content)
+    main.load_openai()
+
+    async def classify(records, on_partial=None):
+        started = time.perf_counter()
+        try:
+            return await main.classify_records(records, on_partial=on_partial)
+        finally:
+            recorder.add("classify_batch", time.perf_counter() - started)
+
+    # 和窗口一样每 RESULT_POLL_MS 毫秒把完成的邮件整批插入表格数据
+    model = TableModel(("类型", "重要级", "日期", "发件人", "收件人", "总结", "日程"), main.row_sort_keys)
+    results = queue.Queue()
+    finished = threading.Event()
+    errors = []
+    # 已经出现在表格里的邮件，first_visible 记录每封邮件第一次显示（流式分类时是部分结果）的时间
+    visible = set()
+
+    def emit(item):
+        results.put(item)
+
+    def drain():
+        while True:
+            done = finished.is_set()
+            rows = []
+            try:
+                while True:
+                    kind, *payload = results.get_nowait()
+                    if kind == "error":
+                        errors.append(payload[1])
+                        continue
+                    if kind not in ("partial", "row"):
+                        continue
+                    record, info = payload
+                    row_key = (record["account"], record["mailbox"], record["uid"])
+                    if row_key not in visible:
+                        visible.add(row_key)
+                        recorder.add("first_visible", time.perf_counter() - started)
+                    if kind == "row":
+                        rows.append(((info["类型"], info["重要级"], record["headers"]["日期"], info["发件人"],
+                                      info["收件人"], info["总结"], info["日程"]), None))
+            except queue.Empty:
+                pass
+            if rows:
+                inserted = time.perf_counter()
+                model.insert_rows(rows)
+                recorder.add("ui_insert_batch", time.perf_counter() - inserted)
+                for _ in rows:
+                    recorder.add("end_to_end", time.perf_counter() - started)
+            if done:
+                return
+            time.sleep(main.RESULT_POLL_MS / 1000)
+
+    drainer = threading.Thread(target=drain, daemon=True)
+    started = time.perf_counter()
+    drainer.start()
+    asyncio.run(main.run_pipeline(main.record_sources(None, limit=args.emails), classify, emit,
+                                  main.CLASSIFY_WORKERS, main.make_classification_batches, main.metrics,
+                                  partial=main.STREAM, key=main.record_key, buffer=main.PIPELINE_BUFFER))
+    finished.set()
+    drainer.join()
+    elapsed = time.perf_counter() - started
+    for mail_account in main.mail_accounts:
+        mail_account.close()
+
+    imap_commands = {}
+    for server in imap_servers:
+        for command, count in server.commands.items():
+            imap_commands[command] = imap_commands.get(command, 0) + count
+
+    report = {
+        "emails": len(model),
+        "errors": len(errors),
+        "seconds": elapsed,
+        "emails_per_second": len(model) / elapsed if elapsed else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": recorder.summary(),
+        "imap_commands": imap_commands,
+        "llm": {
+            "requests": openai_server.requests,
+            "rate_limited": openai_server.rate_limited,
+            "prompt_tokens": openai_server.prompt_tokens,
+            "completion_tokens": openai_server.completion_tokens,
+        },
+        # 程序自己记录的运行指标，可以和上面替身侧的统计对照
+        "metrics": main.metrics.snapshot(),
+        "settings": vars(args),
+    }
+    for server in imap_servers:
+        server.shutdown()
+    openai_server.shutdown()
+    return report
+
+def print_report(report, file=None):
+    file = file or sys.stdout
+    peak = report["peak_rss_mb"]
+    print(f"emails: {report['emails']}  errors: {report['errors']}  time: {report['seconds']:.2f}s  "
+          f"throughput: {report['emails_per_second']:.1f} emails/s  "
+          f"peak RSS: {'n/a' if peak is None else f'{peak:.1f} MB'}", file=file)
+    llm = report["llm"]
+    print(f"API requests: {llm['requests']}  429s: {llm['rate_limited']}  "
+          f"tokens: {llm['prompt_tokens']} in / {llm['completion_tokens']} out", file=file)
+    print(f"{'stage':<18}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}", file=file)
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<18}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+              f"{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}", file=file)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,108 @@
+import tkinter as tk
+from tkinter import ttk
+
+from table_model import TableModel
+
+# 虚拟化的邮件表格：所有行保存在 TableModel 里，Treeview 只保留当前能看到的那几行，
+# 滚动时复用这些行、只改它们的值，所以上万封邮件也不会让界面卡住
+
+DEFAULT_ROW_HEIGHT = 20
+
+
+class VirtualTable:
+    def __init__(self, parent, columns, row_tags=None, sort_keys=None):
+        self.columns = columns
+        self.model = TableModel(columns, sort_keys)
+        frame = tk.Frame(parent)
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        self.tree = ttk.Treeview(frame, columns=columns, show="headings")
+        self.scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # 行颜色的标签只配置一次
+        for tag, background in (row_tags or {}).items():
+            self.tree.tag_configure(tag, background=background)
+
+        self.offset = 0
+        self.visible = 1
+        self.row_height = int(ttk.Style().lookup("Treeview", "rowheight") or DEFAULT_ROW_HEIGHT)
+        # Treeview 里实际存在的行，个数等于能显示的行数
+        self.items = []
+
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<MouseWheel>", lambda event: self.scroll(-1 if event.delta > 0 else 1, "units"))
+        self.tree.bind("<Button-4>", lambda event: self.scroll(-1, "units"))
+        self.tree.bind("<Button-5>", lambda event: self.scroll(1, "units"))
+
+    def __len__(self):
+        return len(self.model)
+
+    # 在最前面插入一批行（rows 里越靠后的越新，显示在越上面）；正在往下翻看时保持看到的内容不动
+    # 返回这些行在 model 里的行号，之后可以用 update_rows 修改
+    def insert_rows(self, rows):
+        if not rows:
+            return range(0)
+        indexes = self.model.insert_rows(rows)
+        if self.offset:
+            self.offset += len(rows)
+        self.refresh()
+        return indexes
+
+    # 原地修改一些行 {行号: (值元组, 标签)}
+    def update_rows(self, updates):
+        if not updates:
+            return
+        self.model.update_rows(updates)
+        self.refresh()
+
+    def clear(self):
+        self.model.clear()
+        self.offset = 0
+        self.refresh()
+
+    # 按某一列重新排列所有行，回到第一页
+    def sort(self, column, reverse=False):
+        self.model.sort(column, reverse)
+        self.offset = 0
+        self.refresh()
+
+    def on_resize(self, event):
+        # 表头大约占一行的高度
+        visible = max(1, event.height // self.row_height - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self.refresh()
+
+    # 滚动条拖动和点击
+    def yview(self, action, value, unit=None):
+        if action == "moveto":
+            self.offset = int(float(value) * len(self.model))
+            self.refresh()
+        elif action == "scroll":
+            self.scroll(int(value), unit)
+
+    def scroll(self, amount, unit="units"):
+        step = self.visible if unit == "pages" else 1
+        self.offset += amount * step
+        self.refresh()
+
+    # 把当前窗口里的行写进 Treeview，只增删差出来的几行，其余行原地改值
+    def refresh(self):
+        total = len(self.model)
+        self.offset = max(0, min(self.offset, total - self.visible))
+        window = self.model.window(self.offset, self.visible)
+
+        while len(self.items) > len(window):
+            self.tree.delete(self.items.pop())
+        while len(self.items) < len(window):
+            self.items.append(self.tree.insert("", tk.END))
+
+        for item, (values, tag) in zip(self.items, window):
+            self.tree.item(item, values=values, tags=(tag,) if tag else ())
+
+        if total:
+            self.scrollbar.set(self.offset / total, (self.offset + len(window)) / total)
+        else:
+            self.scrollbar.set(0, 1)
@@ -0,0 +1,168 @@
+import argparse
+import json
+import sys
+import threading
+from datetime import datetime
+
+from main import (CACHE_ENABLED, CACHE_PATH, CLASSIFICATION_FIELDS, CLASSIFY_WORKERS, LOCAL_MODEL_ENABLED, PIPELINE_BUFFER,
+                  SEARCH_ENABLED, SEARCH_LIMIT, SEARCH_PATH, data_path, local_model, mail_accounts, iter_records,
+                  load_new_records, record_sources, record_key, classify_records, make_classification_batches, metrics,
+                  watch_mailbox, write_metrics)
+from mail_cache import MailCache
+from mail_query import SearchFilter
+from search_index import SearchIndex
+from threads import thread_records
+from pipeline import BackgroundLoop, run_pipeline
+
+# 无界面模式：不导入 tkinter，把分类结果按 JSON Lines 写到标准输出或文件，方便放在服务器上运行、接入其他工具
+#
+#   python headless.py --limit 50                                  # 分类最新的 50 封邮件后退出
+#   python headless.py --start-date 2024-11-01 --end-date 2024-11-08 -o result.jsonl
+#   python headless.py --limit 20 --start 20 --unseen --from dean@  # 未读、发件人含 dean@ 的第 21~40 封
+#   python headless.py --limit 0 --follow                          # 不处理旧邮件，一直监听新邮件
+#   python headless.py --limit 200 --metrics metrics.json           # 另外导出运行指标
+#   python headless.py --search "施工 图书馆"                        # 在本地索引里搜索处理过的邮件，不联网
+#
+# 标准输出只有结果，每行一封邮件；日志和错误打印到标准错误
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="邮件分类（无界面模式），结果按 JSON Lines 输出")
+    parser.add_argument("--mailbox", help="只加载第一个账号的这个文件夹，默认加载所有账号配置的 FOLDERS；--follow 默认监听 inbox")
+    parser.add_argument("--limit", type=int, default=10, help="按数量加载最新的邮件数，默认 10，0 表示不加载")
+    parser.add_argument("--start", type=int, default=0, help="按数量加载时跳过最新的这么多封，用来翻页")
+    parser.add_argument("--start-date", help="按日期加载的起始日期 (YYYY-MM-DD)")
+    parser.add_argument("--end-date", help="按日期加载的结束日期 (YYYY-MM-DD)")
+    parser.add_argument("--from", dest="sender", help="只加载发件人包含这个字符串的邮件（服务器端搜索）")
+    parser.add_argument("--subject", help="只加载主题包含这个关键词的邮件（服务器端搜索）")
+    parser.add_argument("--unseen", action="store_true", help="只加载未读邮件")
+    parser.add_argument("--flagged", action="store_true", help="只加载星标邮件")
+    parser.add_argument("--follow", action="store_true", help="处理完之后继续用 IDLE 监听新邮件，Ctrl+C 退出")
+    parser.add_argument("-o", "--output", help="结果追加写入这个文件，默认写到标准输出")
+    parser.add_argument("--search", metavar="QUERY", help="在本地全文索引里搜索处理过的邮件，输出结果后退出，"
+                                                          "不连接邮箱；空格分隔的多个关键词需要同时出现")
+    parser.add_argument("--metrics", help="每处理完一批邮件后把运行指标写入这个文件，扩展名为 .json 时写 JSON，"
+                                          "否则写 Prometheus 文本格式")
+    args = parser.parse_args(argv)
+
+    if bool(args.start_date) != bool(args.end_date):
+        parser.error("--start-date 和 --end-date 需要同时指定")
+    for value in (args.start_date, args.end_date):
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                parser.error(f"日期格式应为 YYYY-MM-DD: {value}")
+    return args
+
+# 一封邮件的输出：邮件标识、主题、日期，再加上分类的各个字段；会话分组时是会话里最新的一封，另外注明会话和邮件数
+def result_line(record, info):
+    result = {
+        "account": record["account"],
+        "uid": record["uid"],
+        "mailbox": record["mailbox"],
+        "uidvalidity": record["uidvalidity"],
+        "日期": record["headers"].get("日期", ""),
+        "主题": record["headers"].get("主题", ""),
+    }
+    result.update((key, info.get(key, "")) for key in CLASSIFICATION_FIELDS)
+    if record.get("thread"):
+        result["thread"] = record["thread"]
+        result["thread_size"] = record.get("thread_size") or len(thread_records(record))
+    return json.dumps(result, ensure_ascii=False)
+
+# 本地搜索结果的输出，字段和 result_line 一样
+def search_line(document):
+    record = {key: document[key] for key in ("account", "uid", "mailbox", "uidvalidity")}
+    record["headers"] = {"日期": document["date"], "主题": document["subject"]}
+    info = dict(zip(CLASSIFICATION_FIELDS, (document["category"], document["priority"], document["sender"],
+                                            document["recipient"], document["summary"], document["schedule"])))
+    return result_line(record, info)
+
+def search(args):
+    if not SEARCH_ENABLED:
+        sys.exit("本地搜索没有开启（[SEARCH] ENABLED）")
+    index = SearchIndex(data_path(SEARCH_PATH))
+    output = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for document in index.search(args.search, SEARCH_LIMIT):
+            output.write(search_line(document) + "\n")
+    finally:
+        index.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+def run(args):
+    output = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    # 其他模块的 print 都转到标准错误，标准输出只留结果
+    sys.stdout = sys.stderr
+
+    cache = MailCache(data_path(CACHE_PATH)) if CACHE_ENABLED else None
+    index = SearchIndex(data_path(SEARCH_PATH)) if SEARCH_ENABLED else None
+    # 和界面一样用缓存里已有的分类结果训练本地模型；这里没有窗口要显示，训练完再开始拉取，第一批邮件就能用上
+    if LOCAL_MODEL_ENABLED and cache:
+        local_model.train(cache.labelled_messages())
+    background = BackgroundLoop()
+    lock = threading.Lock()
+
+    # 在事件循环线程里调用
+    def emit(item):
+        kind, *payload = item
+        if kind == "row":
+            record, info = payload
+            with lock:
+                output.write(result_line(record, info) + "\n")
+                output.flush()
+        elif kind == "error" and payload[0] is not None:
+            print(f"Failed to classify UID {payload[0]['uid']}: {payload[1]}")
+
+    # 拉取并分类，等这一批全部完成后返回
+    def process(load):
+        try:
+            background.submit(run_pipeline(load, lambda records: classify_records(records, cache, index=index), emit,
+                                           CLASSIFY_WORKERS, make_classification_batches, metrics,
+                                           key=record_key, buffer=PIPELINE_BUFFER)).result()
+        finally:
+            if args.metrics:
+                write_metrics(args.metrics)
+
+    def handle_new_mail(mail, last_uid):
+        records, last_uid = load_new_records(cache, mail, last_uid, mailbox=args.mailbox or 'inbox')
+        if not records:
+            return last_uid
+        print(f"{len(records)} 封新邮件到达，正在处理...")
+        process(lambda: records)
+        return last_uid
+
+    try:
+        search = {"start_date": args.start_date, "end_date": args.end_date} if args.start_date else \
+            {"limit": args.limit, "start": args.start}
+        search["search_filter"] = SearchFilter(args.sender, args.subject, args.unseen, args.flagged)
+        if args.start_date or args.limit > 0:
+            if args.mailbox:
+                process(lambda: iter_records(cache, mailbox=args.mailbox, **search))
+            else:
+                process(record_sources(cache, **search))
+
+        if args.follow:
+            watch_mailbox(handle_new_mail, stopped=lambda: False, mailbox=args.mailbox or 'inbox')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for mail_account in mail_accounts:
+            mail_account.close()
+        if cache:
+            cache.close()
+        if index is not None:
+            index.close()
+        if output is not sys.__stdout__:
+            output.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.search:
+        search(args)
+    else:
+        run(args)
@@ -0,0 +1,127 @@
+import imaplib
+import threading
+import time
+from contextlib import contextmanager
+
+# IMAP 连接池：保持已登录（并且已经 SELECT 过）的连接，定时 NOOP 保活，坏掉的连接自动重连
+# 避免每次加载都重新握手、登录，也不会在服务器上留下没有 LOGOUT 的连接
+
+# 连接断开时 imaplib 可能抛出的异常
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+
+
+class IMAPPool:
+    def __init__(self, connect, size=2, keepalive=240):
+        self.connect = connect
+        self.size = size
+        self.keepalive = keepalive
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+        # 空闲连接 [(连接, 上次使用时间)]
+        self.idle = []
+        self.closed = False
+        self.keepalive_thread = None
+
+    # 连接是否还能用：最近用过的直接认为可用，否则发一个 NOOP 检查
+    def _healthy(self, mail, last_used):
+        if time.monotonic() - last_used < self.keepalive:
+            return True
+        try:
+            return mail.noop()[0] == 'OK'
+        except Exception:
+            return False
+
+    def _discard(self, mail):
+        try:
+            mail.logout()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                mail, last_used = self.idle.pop()
+            if self._healthy(mail, last_used):
+                return mail
+            self._discard(mail)
+        return self.connect()
+
+    def _checkin(self, mail):
+        with self.lock:
+            if not self.closed:
+                self.idle.append((mail, time.monotonic()))
+                mail = None
+        if mail is not None:
+            self._discard(mail)
+        self._start_keepalive()
+
+    # 借出一个连接，用完自动归还；连接在使用中断开时直接丢弃，不放回池里
+    @contextmanager
+    def session(self):
+        self.slots.acquire()
+        mail = None
+        try:
+            mail = self._checkout()
+            yield mail
+        except CONNECTION_ERRORS:
+            if mail is not None:
+                self._discard(mail)
+                mail = None
+            raise
+        finally:
+            if mail is not None:
+                self._checkin(mail)
+            self.slots.release()
+
+    # 用池里的连接迭代 func(mail) 产生的结果，迭代完才归还连接；还没产生任何结果时连接断开会换一个新连接重试
+    def stream(self, func, retries=1):
+        for attempt in range(retries + 1):
+            started = False
+            try:
+                with self.session() as mail:
+                    for item in func(mail):
+                        started = True
+                        yield item
+                return
+            except CONNECTION_ERRORS as e:
+                if started or attempt == retries:
+                    raise
+                print(f"IMAP connection lost, reconnecting: {e}")
+
+    # 后台线程定时给空闲连接发 NOOP，顺便清理已经断开的连接
+    def _start_keepalive(self):
+        with self.lock:
+            if self.keepalive_thread is not None or self.closed:
+                return
+            self.keepalive_thread = threading.Thread(target=self._keepalive_loop, daemon=True)
+            self.keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        while not self.closed:
+            time.sleep(self.keepalive / 2)
+            now = time.monotonic()
+            with self.lock:
+                stale = [item for item in self.idle if now - item[1] >= self.keepalive / 2]
+                self.idle = [item for item in self.idle if item not in stale]
+
+            for mail, _ in stale:
+                try:
+                    alive = mail.noop()[0] == 'OK'
+                except Exception:
+                    alive = False
+                if alive:
+                    with self.lock:
+                        if not self.closed:
+                            self.idle.append((mail, time.monotonic()))
+                            continue
+                self._discard(mail)
+
+    # 关闭所有空闲连接
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for mail, _ in idle:
+            self._discard(mail)
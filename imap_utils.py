@@ -0,0 +1,304 @@
+import imaplib
+import re
+import select
+import ssl
+import time
+
+# IMAP 协议相关的小工具：序列集构造、FETCH 响应解析、BODYSTRUCTURE 解析、选择邮箱、IDLE
+
+# 把 UID 列表压缩成 IMAP 序列集，例如 [1, 2, 3, 7] -> "1:3,7"
+def build_uid_set(uids):
+    numbers = sorted({int(uid) for uid in uids})
+    ranges = []
+    for number in numbers:
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ",".join(str(lo) if lo == hi else f"{lo}:{hi}" for lo, hi in ranges)
+
+# 把序列集展开成 UID 列表，例如 "1:3,7" -> [1, 2, 3, 7]，是 build_uid_set 的逆操作
+def parse_uid_set(uid_set):
+    if isinstance(uid_set, bytes):
+        uid_set = uid_set.decode()
+    uids = []
+    for item in uid_set.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        lo, _, hi = item.partition(":")
+        lo, hi = int(lo), int(hi or lo)
+        uids.extend(range(min(lo, hi), max(lo, hi) + 1))
+    return uids
+
+# 登录之后服务器的能力列表：大多数服务器（Dovecot、Gmail 等）登录后才列出 CONDSTORE、QRESYNC、ENABLE、ESEARCH，
+# 而 imaplib 的 mail.capabilities 是连接时的问候里给出的，login() 不会更新它
+# 优先使用 LOGIN 响应里的 [CAPABILITY ...]，没有时再发一次 CAPABILITY；结果写回 mail.capabilities，imaplib 自己的检查也用它
+_CAPABILITY_CODE = re.compile(rb'\[CAPABILITY ([^\]]*)\]', re.IGNORECASE)
+
+def refresh_capabilities(mail, login_response=None):
+    text = None
+    for line in login_response or []:
+        match = _CAPABILITY_CODE.search(line) if isinstance(line, bytes) else None
+        if match:
+            text = match.group(1)
+    if text is None:
+        result, data = mail.capability()
+        if result == 'OK' and data and isinstance(data[-1], bytes):
+            text = data[-1]
+    if text is not None:
+        mail.capabilities = tuple(text.decode('ascii', errors='replace').upper().split())
+    return mail.capabilities
+
+def has_capability(mail, name):
+    return name in getattr(mail, 'capabilities', ())
+
+# 从 FETCH 响应行中取出 UID
+def parse_fetch_uid(response_line):
+    match = re.search(rb'UID (\d+)', response_line)
+    return int(match.group(1)) if match else None
+
+
+# 字面量（{n} 之后的原始数据），和普通字符串区分开
+class Literal(bytes):
+    pass
+
+
+_LITERAL_SUFFIX = re.compile(rb'\{(\d+)\}\s*$')
+
+# 把一段响应文本切分成 token：'(' ')' 字符串 原子 NIL(None)
+def _tokenize(data, tokens):
+    i = 0
+    length = len(data)
+    while i < length:
+        char = data[i:i + 1]
+        if char in (b' ', b'\r', b'\n'):
+            i += 1
+        elif char in (b'(', b')'):
+            tokens.append(char.decode())
+            i += 1
+        elif char == b'"':
+            # 带引号的字符串，处理 \" 和 \\ 转义
+            i += 1
+            value = bytearray()
+            while i < length and data[i:i + 1] != b'"':
+                if data[i:i + 1] == b'\\':
+                    i += 1
+                value += data[i:i + 1]
+                i += 1
+            tokens.append(bytes(value))
+            i += 1
+        else:
+            # 原子，BODY[HEADER.FIELDS (FROM TO)]<0> 这种方括号里的空格和括号也算在原子里
+            start = i
+            depth = 0
+            while i < length:
+                char = data[i:i + 1]
+                if char == b'[':
+                    depth += 1
+                elif char == b']':
+                    depth -= 1
+                elif depth == 0 and char in (b' ', b'(', b')', b'\r', b'\n'):
+                    break
+                i += 1
+            atom = data[start:i]
+            tokens.append(None if atom.upper() == b'NIL' else atom)
+
+# 把 imaplib 返回的 FETCH 数据（bytes 和 (前缀, 字面量) 元组混合）转换成 token 流
+def _fetch_tokens(message_data):
+    tokens = []
+    for item in message_data:
+        if isinstance(item, tuple):
+            prefix, literal = item
+            _tokenize(_LITERAL_SUFFIX.sub(b'', prefix), tokens)
+            tokens.append(Literal(literal))
+        elif item:
+            _tokenize(item, tokens)
+    return tokens
+
+def _parse_list(tokens, pos):
+    # tokens[pos] 是 '('，返回 (列表, 下一个位置)
+    result = []
+    pos += 1
+    while pos < len(tokens) and tokens[pos] != ')':
+        if tokens[pos] == '(':
+            value, pos = _parse_list(tokens, pos)
+            result.append(value)
+        else:
+            result.append(tokens[pos])
+            pos += 1
+    return result, pos + 1
+
+# 解析 FETCH 响应，每封邮件返回一个 {数据项名称: 值} 字典，名称统一为大写 str
+def parse_fetch_response(message_data):
+    tokens = _fetch_tokens(message_data)
+    responses = []
+    pos = 0
+    while pos < len(tokens):
+        if tokens[pos] == '(':
+            items, pos = _parse_list(tokens, pos)
+            fields = {}
+            for key, value in zip(items[::2], items[1::2]):
+                if isinstance(key, bytes):
+                    fields[key.decode(errors='ignore').upper()] = value
+            responses.append(fields)
+        else:
+            pos += 1
+    return responses
+
+def _as_text(value):
+    if isinstance(value, bytes):
+        return value.decode(errors='ignore')
+    return ""
+
+# BODYSTRUCTURE 里的参数列表 ("charset" "utf-8" ...) 转成字典
+def _body_params(value):
+    if not isinstance(value, list):
+        return {}
+    return {_as_text(key).lower(): _as_text(val) for key, val in zip(value[::2], value[1::2])}
+
+def _body_disposition(part, is_text):
+    # text 类型比其他单体多一个行数字段，所以 disposition 的位置不一样
+    index = 9 if is_text else 8
+    if len(part) > index and isinstance(part[index], list) and part[index]:
+        return _as_text(part[index][0]).lower()
+    return ""
+
+# 遍历 BODYSTRUCTURE，返回 [(部件编号, 信息字典)]，不会进入附件里的 message/rfc822
+def walk_bodystructure(structure, prefix=""):
+    if not isinstance(structure, list) or not structure:
+        return []
+
+    if isinstance(structure[0], list):
+        # multipart：前面若干个是子部件，后面是子类型和扩展数据
+        parts = []
+        number = 1
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            parts.extend(walk_bodystructure(child, f"{prefix}{number}."))
+            number += 1
+        return parts
+
+    content_type = f"{_as_text(structure[0])}/{_as_text(structure[1])}".lower()
+    is_text = content_type.startswith("text/")
+    info = {
+        "content_type": content_type,
+        "params": _body_params(structure[2]),
+        "encoding": _as_text(structure[5]).lower() if len(structure) > 5 else "",
+        "size": int(structure[6]) if len(structure) > 6 and structure[6] else 0,
+        "disposition": _body_disposition(structure, is_text),
+    }
+    # 单体邮件的正文编号是 1
+    return [(prefix.rstrip(".") or "1", info)]
+
+# 找到要作为正文的部件，按 content_types 的顺序优先，逻辑和 extract_email_content 保持一致
+def find_text_part(structure, content_types=("text/plain",)):
+    parts = walk_bodystructure(structure)
+    if len(parts) == 1 and not isinstance(structure[0], list):
+        # 单体邮件是文本时直接取正文；只有一个 PDF 之类的二进制部件时没有正文，只按邮件头分类
+        return parts[0] if parts[0][1]["content_type"].startswith("text/") else None
+    for content_type in content_types:
+        for number, info in parts:
+            if info["content_type"] == content_type and info["disposition"] != "attachment":
+                return number, info
+    return None
+
+
+# 选择邮箱，返回它的 UIDVALIDITY（服务器没给时返回 None）
+# 连接池里的连接已经选中同一个邮箱时不再重复 SELECT，SEARCH 本身就能看到新邮件
+# 文件夹名里有空格或引号时（例如 "Junk E-mail"）需要加上引号
+def quote_mailbox(mailbox):
+    if mailbox.startswith('"') or not any(c in mailbox for c in ' "\\(){%*'):
+        return mailbox
+    return '"' + mailbox.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def select_mailbox(mail, mailbox='inbox'):
+    if mail.state == 'SELECTED' and getattr(mail, 'selected_mailbox', None) == mailbox:
+        return mail.selected_uidvalidity
+
+    result, data = mail.select(quote_mailbox(mailbox))
+    if result != 'OK':
+        raise imaplib.IMAP4.error(f"SELECT {mailbox} failed: {data!r}")
+    _, data = mail.response('UIDVALIDITY')
+    _, uidnext = mail.response('UIDNEXT')
+    mail.selected_mailbox = mailbox
+    mail.selected_uidvalidity = int(data[0]) if data and data[0] else None
+    # 选中时的 UIDNEXT，实时监听用它确定从哪封邮件开始算新邮件
+    mail.selected_uidnext = int(uidnext[0]) if uidnext and uidnext[0] else None
+    return mail.selected_uidvalidity
+
+
+# 服务器在 IDLE 期间推送的、需要结束 IDLE 去处理的响应
+_IDLE_EVENTS = re.compile(rb'^\* (\d+) (EXISTS|EXPUNGE)\b', re.IGNORECASE)
+
+# 解析 IDLE 期间收到的未标记响应，返回 [(编号, "EXISTS"/"EXPUNGE")]
+def parse_idle_events(lines):
+    events = []
+    for line in lines:
+        match = _IDLE_EVENTS.match(line)
+        if match:
+            events.append((int(match.group(1)), match.group(2).decode().upper()))
+    return events
+
+def _socket_ready(sock, timeout):
+    # SSL 连接里可能已经有解密好但还没读出的数据，select 看不到
+    if hasattr(sock, 'pending') and sock.pending():
+        return True
+    return bool(select.select([sock], [], [], timeout)[0])
+
+# 不等待网络，读出 mail.file 里已经缓冲的数据：imaplib 按块读取，上一条命令或 IDLE 续行之后到达的响应
+# 可能已经在缓冲区里，socket 上 select 不到；缓冲区空时非阻塞地读一次 socket
+def _read_buffered(mail):
+    timeout = mail.sock.gettimeout()
+    mail.sock.settimeout(0)
+    try:
+        return mail.file.read1(65536) or b''
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return b''
+    finally:
+        mail.sock.settimeout(timeout)
+
+# 在已选中邮箱的连接上执行一次 IDLE，直到收到 EXISTS/EXPUNGE、超时（服务器一般 30 分钟断开，默认 29 分钟重新 IDLE）
+# 或者 stop() 返回 True；返回 IDLE 期间收到的所有未标记响应行
+def idle_wait(mail, timeout=29 * 60, stop=None):
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    # 续行之前服务器可能先推送了未标记响应
+    lines = []
+    line = mail.readline()
+    while line.startswith(b'* '):
+        lines.append(line.rstrip(b'\r\n'))
+        line = mail.readline()
+    if not line.startswith(b'+'):
+        raise imaplib.IMAP4.error(f"IDLE rejected: {line!r}")
+
+    # IDLE 期间全部经 mail.file 读取：先取缓冲区里已有的数据，没有时才用 select 等待 socket，不会卡在 readline 上
+    buffer = b''
+    deadline = time.monotonic() + timeout
+    while not parse_idle_events(lines) and time.monotonic() < deadline and not (stop and stop()):
+        data = _read_buffered(mail)
+        if not data:
+            if not _socket_ready(mail.sock, min(1.0, max(0.0, deadline - time.monotonic()))):
+                continue
+            data = mail.file.read1(65536)
+            if not data:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+        buffer += data
+        while b'\r\n' in buffer:
+            line, buffer = buffer.split(b'\r\n', 1)
+            lines.append(line)
+
+    # 结束 IDLE，读到这条命令的标记响应为止
+    mail.send(b'DONE\r\n')
+    while True:
+        if b'\r\n' in buffer:
+            line, buffer = buffer.split(b'\r\n', 1)
+        else:
+            line = buffer + mail.readline().rstrip(b'\r\n')
+            buffer = b''
+        if line.startswith(tag):
+            if b' OK' not in line[len(tag):len(tag) + 4].upper():
+                raise imaplib.IMAP4.error(f"IDLE failed: {line!r}")
+            return lines
+        lines.append(line)
@@ -0,0 +1,171 @@
+import math
+import re
+import threading
+import zlib
+from collections import Counter, defaultdict
+from email.utils import getaddresses
+
+from rules import is_bulk, split_list
+
+# 本地轻量分类器：用已经由模型分类过的邮件训练哈希 n-gram 朴素贝叶斯，分别预测 类型 和 重要级
+# 只有在足够自信、并且历史上自信的预测足够准的时候才代替 API 调用，其余邮件照常交给模型
+#
+# 准确率用“先预测再学习”的方式在线估计：每来一个模型给出的标签，先用当前模型预测一次，
+# 记录自信预测是否正确，然后再学习这个标签
+
+FEATURE_BUCKETS = 1 << 18
+CONTENT_CHARS = 2000
+_WORD = re.compile(r'[a-z0-9]{2,}')
+
+
+def _bucket(feature):
+    return zlib.crc32(feature.encode('utf-8')) & (FEATURE_BUCKETS - 1)
+
+def _bigrams(prefix, text):
+    text = re.sub(r'\s+', ' ', text.casefold())
+    return [f"{prefix}{text[i:i + 2]}" for i in range(len(text) - 1)]
+
+# 提取特征：主题和正文的字二元组、英文单词、发件人域名、是否群发
+def extract_features(headers, content):
+    subject = headers.get("主题", "")
+    content = (content or "")[:CONTENT_CHARS]
+    features = _bigrams("s:", subject) + _bigrams("b:", content)
+    features += [f"w:{word}" for word in _WORD.findall(f"{subject} {content}".casefold())]
+    for _, address in getaddresses([headers.get("发件人", "")]):
+        if "@" in address:
+            features.append(f"d:{address.rsplit('@', 1)[1].lower()}")
+    if is_bulk(headers):
+        features.append("bulk")
+    return Counter(_bucket(feature) for feature in features)
+
+
+# 多项式朴素贝叶斯，支持增量学习
+class NaiveBayes:
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.class_counts = Counter()
+        self.feature_counts = defaultdict(Counter)
+        self.feature_totals = Counter()
+        self.seen_features = set()
+        # log((count + alpha) / alpha)，学习时更新，预测时只需要查表；没出现过的特征对应 0
+        self.feature_weights = defaultdict(dict)
+
+    def learn(self, features, label):
+        self.class_counts[label] += 1
+        counts = self.feature_counts[label]
+        weights = self.feature_weights[label]
+        for feature, count in features.items():
+            counts[feature] += count
+            weights[feature] = math.log((counts[feature] + self.alpha) / self.alpha)
+            self.feature_totals[label] += count
+            self.seen_features.add(feature)
+
+    # 返回 (最可能的标签, 后验概率)
+    def predict(self, features):
+        if not self.class_counts:
+            return None, 0.0
+
+        total = sum(self.class_counts.values())
+        vocabulary = len(self.seen_features) or 1
+        feature_count = sum(features.values())
+        log_alpha = math.log(self.alpha)
+        scores = {}
+        for label, class_count in self.class_counts.items():
+            weights = self.feature_weights[label]
+            denominator = math.log(self.feature_totals[label] + self.alpha * vocabulary)
+            scores[label] = (math.log(class_count / total) + feature_count * (log_alpha - denominator)
+                             + sum(count * weights.get(feature, 0.0) for feature, count in features.items()))
+
+        best = max(scores, key=scores.get)
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / normalizer
+
+
+class LocalClassifier:
+    def __init__(self, threshold=0.9, min_samples=200, min_precision=0.95, min_checked=50, priorities=("一般通知",)):
+        self.threshold = threshold
+        # 只有预测为这些重要级的邮件才由本地模型直接分类，可能重要的邮件仍然交给模型写总结和日程
+        self.priorities = set(priorities)
+        self.min_samples = min_samples
+        self.min_precision = min_precision
+        self.min_checked = min_checked
+        self.lock = threading.Lock()
+        self.type_model = NaiveBayes()
+        self.priority_model = NaiveBayes()
+        self.samples = 0
+        # 自信预测的在线评估结果
+        self.checked = 0
+        self.correct = 0
+        self.hits = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            threshold=config.getfloat('LOCAL_MODEL', 'THRESHOLD', fallback=0.9),
+            min_samples=config.getint('LOCAL_MODEL', 'MIN_SAMPLES', fallback=200),
+            min_precision=config.getfloat('LOCAL_MODEL', 'MIN_PRECISION', fallback=0.95),
+            priorities=split_list(config.get('LOCAL_MODEL', 'PRIORITIES', fallback='一般通知')),
+        )
+
+    def _predict_locked(self, features):
+        type_info, type_confidence = self.type_model.predict(features)
+        priority, priority_confidence = self.priority_model.predict(features)
+        return type_info, priority, min(type_confidence, priority_confidence)
+
+    # 学习一个模型给出的分类结果，学习前先用来评估本地模型
+    def learn(self, headers, content, info):
+        if not info.get("重要级"):
+            return
+        features = extract_features(headers, content)
+        with self.lock:
+            if self.samples >= self.min_samples:
+                type_info, priority, confidence = self._predict_locked(features)
+                if confidence >= self.threshold and priority in self.priorities:
+                    self.checked += 1
+                    self.correct += type_info == info["类型"] and priority == info["重要级"]
+            self.type_model.learn(features, info["类型"])
+            self.priority_model.learn(features, info["重要级"])
+            self.samples += 1
+
+    # 按时间顺序用缓存里的历史标签训练，samples 是 (邮件头, 正文, 分类结果) 的可迭代对象
+    def train(self, samples):
+        for headers, content, info in samples:
+            self.learn(headers, content, info)
+
+    # 本地模型是否已经足够可靠
+    def ready(self):
+        with self.lock:
+            return (self.samples >= self.min_samples and self.checked >= self.min_checked
+                    and self.correct / self.checked >= self.min_precision)
+
+    # 返回分类字段字典，不够自信时返回 None
+    def predict(self, headers, content):
+        if not self.ready():
+            return None
+        features = extract_features(headers, content)
+        with self.lock:
+            type_info, priority, confidence = self._predict_locked(features)
+            if confidence < self.threshold or priority not in self.priorities:
+                return None
+            self.hits += 1
+        return {
+            "类型": type_info,
+            "重要级": priority,
+            "发件人": headers.get("发件人", ""),
+            "收件人": headers.get("收件人", ""),
+            "总结": headers.get("主题", ""),
+            "日程": "",
+        }
+
+    # 给本地模型有把握的记录直接填上分类结果，返回原列表
+    def apply(self, records):
+        for record in records:
+            if record["classification"] is None:
+                info = self.predict(record["headers"], record["content"])
+                if info is not None:
+                    record["classification"] = info
+        return records
+
+    def stats(self):
+        with self.lock:
+            return {"samples": self.samples, "checked": self.checked, "correct": self.correct, "hits": self.hits}
@@ -0,0 +1,352 @@
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 本地邮件缓存：按 (账号, 邮箱, UIDVALIDITY, UID) 保存解析后的邮件头、正文和分类结果
+# UIDVALIDITY 变了说明服务器上的 UID 已经失效，对应邮箱的缓存会整体清掉
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mailboxes (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    PRIMARY KEY (account, mailbox)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    content TEXT NOT NULL,
+    classification TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (account, mailbox, uidvalidity, uid)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    highestmodseq INTEGER,
+    uidnext INTEGER,
+    messages INTEGER,
+    PRIMARY KEY (account, mailbox)
+);
+CREATE TABLE IF NOT EXISTS mailbox_uids (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uid INTEGER NOT NULL,
+    PRIMARY KEY (account, mailbox, uid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS thread_ids (
+    message_id TEXT PRIMARY KEY,
+    thread_id TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    classification TEXT,
+    members TEXT NOT NULL,
+    last_date TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class MailCache:
+    def __init__(self, path):
+        self.path = path
+        # 处理邮件的线程会同时读写，所有操作都用同一个连接加锁完成
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    # 记录邮箱当前的 UIDVALIDITY，和上次不一样时清掉该邮箱的旧缓存
+    def check_uidvalidity(self, account, mailbox, uidvalidity):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT uidvalidity FROM mailboxes WHERE account = ? AND mailbox = ?",
+                (account, mailbox),
+            ).fetchone()
+            if row and row[0] == uidvalidity:
+                return True
+
+            self.conn.execute(
+                "DELETE FROM messages WHERE account = ? AND mailbox = ?", (account, mailbox)
+            )
+            self._clear_sync_locked(account, mailbox)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO mailboxes (account, mailbox, uidvalidity) VALUES (?, ?, ?)",
+                (account, mailbox, uidvalidity),
+            )
+            self.conn.commit()
+            return False
+
+    # 批量读取缓存，返回 {uid: {"headers": ..., "content": ..., "classification": ...}}
+    def get_messages(self, account, mailbox, uidvalidity, uids):
+        uids = [int(uid) for uid in uids]
+        records = {}
+        with self.lock:
+            # SQLite 对参数个数有限制，分批查询
+            for i in range(0, len(uids), 500):
+                chunk = uids[i:i + 500]
+                rows = self.conn.execute(
+                    "SELECT uid, headers, content, classification FROM messages "
+                    "WHERE account = ? AND mailbox = ? AND uidvalidity = ? "
+                    f"AND uid IN ({','.join('?' * len(chunk))})",
+                    (account, mailbox, uidvalidity, *chunk),
+                ).fetchall()
+                for uid, headers, content, classification in rows:
+                    records[uid] = {
+                        "headers": json.loads(headers),
+                        "content": content,
+                        "classification": json.loads(classification) if classification else None,
+                    }
+        return records
+
+    def save_message(self, account, mailbox, uidvalidity, uid, headers, content):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO messages (account, mailbox, uidvalidity, uid, headers, content, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (account, mailbox, uidvalidity, uid) DO UPDATE SET "
+                "headers = excluded.headers, content = excluded.content, updated_at = excluded.updated_at",
+                (account, mailbox, uidvalidity, int(uid),
+                 json.dumps(headers, ensure_ascii=False), content, time.time()),
+            )
+            self.conn.commit()
+
+    def save_classification(self, account, mailbox, uidvalidity, uid, classification):
+        self.save_classifications([(account, mailbox, uidvalidity, uid, classification)])
+
+    # 一批分类结果在一个事务里写入，items 是 (account, mailbox, uidvalidity, uid, 分类结果) 的列表
+    def save_classifications(self, items):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE messages SET classification = ?, updated_at = ? "
+                "WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid = ?",
+                [(json.dumps(classification, ensure_ascii=False), now, account, mailbox, uidvalidity, int(uid))
+                 for account, mailbox, uidvalidity, uid, classification in items],
+            )
+            self.conn.commit()
+
+    def _clear_sync_locked(self, account, mailbox):
+        self.conn.execute("DELETE FROM sync_state WHERE account = ? AND mailbox = ?", (account, mailbox))
+        self.conn.execute("DELETE FROM mailbox_uids WHERE account = ? AND mailbox = ?", (account, mailbox))
+
+    # 上次同步后的邮箱状态 {"uidvalidity", "highestmodseq", "uidnext", "messages"}，没有同步过时返回 None
+    def get_sync_state(self, account, mailbox):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT uidvalidity, highestmodseq, uidnext, messages FROM sync_state "
+                "WHERE account = ? AND mailbox = ?",
+                (account, mailbox),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("uidvalidity", "highestmodseq", "uidnext", "messages"), row))
+
+    # 服务器上这个邮箱现有的 UID，从小到大排列
+    def get_mailbox_uids(self, account, mailbox):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT uid FROM mailbox_uids WHERE account = ? AND mailbox = ? ORDER BY uid",
+                (account, mailbox),
+            ).fetchall()
+        return [uid for uid, in rows]
+
+    # 保存一次同步的结果；reset=True 表示 added 是完整的 UID 列表，先清掉旧的
+    def save_sync(self, account, mailbox, state, added=(), vanished=(), reset=False):
+        with self.lock:
+            if reset:
+                self._clear_sync_locked(account, mailbox)
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO mailbox_uids (account, mailbox, uid) VALUES (?, ?, ?)",
+                [(account, mailbox, int(uid)) for uid in added],
+            )
+            self.conn.executemany(
+                "DELETE FROM mailbox_uids WHERE account = ? AND mailbox = ? AND uid = ?",
+                [(account, mailbox, int(uid)) for uid in vanished],
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_state (account, mailbox, uidvalidity, highestmodseq, uidnext, messages) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (account, mailbox, state["uidvalidity"], state.get("highestmodseq"),
+                 state.get("uidnext"), state.get("messages")),
+            )
+            self.conn.commit()
+
+    # 邮件会话：Message-ID（以及主题键）所属的会话 {id: 会话 id}
+    def get_thread_ids(self, message_ids):
+        message_ids = list(message_ids)
+        found = {}
+        with self.lock:
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                found.update(self.conn.execute(
+                    f"SELECT message_id, thread_id FROM thread_ids WHERE message_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall())
+        return found
+
+    def save_thread_ids(self, mapping):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO thread_ids (message_id, thread_id) VALUES (?, ?)", list(mapping.items())
+            )
+            self.conn.commit()
+
+    # 会话上次的分类结果 {"classification", "members", "last_date"}，没有时返回 None
+    def get_thread(self, thread_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT classification, members, last_date FROM threads WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        classification, members, last_date = row
+        return {
+            "classification": json.loads(classification) if classification else None,
+            "members": json.loads(members),
+            "last_date": last_date,
+        }
+
+    def save_thread(self, thread_id, classification, members, last_date):
+        self.save_threads([(thread_id, classification, members, last_date)])
+
+    # 一批会话状态在一个事务里写入，items 是 (thread_id, 分类结果, 成员, 最后日期) 的列表
+    def save_threads(self, items):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO threads (thread_id, classification, members, last_date, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(thread_id, json.dumps(classification, ensure_ascii=False) if classification else None,
+                  json.dumps(sorted(members), ensure_ascii=False), last_date, now)
+                 for thread_id, classification, members, last_date in items],
+            )
+            self.conn.commit()
+
+    # 按更新时间顺序返回所有已分类的邮件 [(邮件头, 正文, 分类结果)]，用来训练本地模型
+    def labelled_messages(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT headers, content, classification FROM messages "
+                "WHERE classification IS NOT NULL ORDER BY updated_at"
+            ).fetchall()
+        return [(json.loads(headers), content, json.loads(classification))
+                for headers, content, classification in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# 计算邮件内容指纹时要去掉的部分
+_SUBJECT_PREFIX = re.compile(r'^\s*((re|fw|fwd|回复|答复|转发)\s*[:：]\s*|\[[^\]]*\]\s*|【[^】]*】\s*)+', re.IGNORECASE)
+_RECIPIENT_LINE = re.compile(r'^\s*(to|cc|from|sent|date|收件人|抄送|发件人|发送时间|日期)\s*[:：]', re.IGNORECASE)
+_URL = re.compile(r'(https?://[^\s?#<>"]+)[^\s<>"]*', re.IGNORECASE)
+_TRACKING_TOKEN = re.compile(r'\b(?=[0-9a-z_-]*\d)[0-9a-z_-]{16,}\b', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+# 去掉 Re/Fwd/列表前缀后的主题，用来比较是不是同一件事
+def normalize_subject(subject):
+    return _WHITESPACE.sub(' ', _SUBJECT_PREFIX.sub('', subject or '')).strip().casefold()
+
+# 主题 + 正文的规范化指纹：忽略 Re/Fwd/列表前缀、收件人行、链接参数和追踪串，同一通知的重复投递会得到相同的值
+def content_fingerprint(subject, content):
+    subject = _SUBJECT_PREFIX.sub('', subject or '')
+    lines = [line for line in (content or '').splitlines() if not _RECIPIENT_LINE.match(line)]
+    body = _URL.sub(r'\1', '\n'.join(lines))
+    body = _TRACKING_TOKEN.sub('#', body)
+    normalized = _WHITESPACE.sub(' ', f"{subject}\n{body}").strip().casefold()
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+# 进程内的分类结果缓存：按内容指纹保存，有容量上限 (LRU) 和过期时间 (TTL)
+# 同一指纹正在被别的协程分类时会等它完成，避免同一批里的重复邮件同时调用 API
+class ClassificationMemo:
+    def __init__(self, max_size=1024, ttl=86400):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.pending_async = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get_locked(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def get(self, key):
+        with self.lock:
+            value = self._get_locked(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    # 命中直接返回，否则 await compute() 并缓存结果，compute() 返回协程；只能在同一个事件循环里使用
+    # 调用方已经用 get() 查过一次（已经计入命中/未命中）时传 count=False，同一次查找不重复统计
+    async def get_or_compute_async(self, key, compute, count=True):
+        with self.lock:
+            value = self._get_locked(key)
+            if value is not None:
+                self.hits += count
+                return value
+
+        pending = self.pending_async.get(key)
+        if pending is not None:
+            try:
+                value = await asyncio.shield(pending)
+                with self.lock:
+                    self.hits += count
+                return value
+            except Exception:
+                # 前一个任务失败或被取消了，自己再算一次
+                pass
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending_async[key] = future
+        try:
+            value = await compute()
+            self.put(key, value)
+            future.set_result(value)
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("cancelled"))
+            # 没有人等待时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            if self.pending_async.get(key) is future:
+                del self.pending_async[key]
+        with self.lock:
+            self.misses += count
+        return value
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
@@ -0,0 +1,135 @@
+import imaplib
+import re
+from datetime import datetime
+
+from imap_utils import has_capability, parse_uid_set
+
+# 服务器端搜索：发件人、主题关键词、未读/星标和日期条件都放进 UID SEARCH，由服务器过滤；
+# 按数量加载时从最新的邮件开始按 UID 窗口往前翻页，不用列出整个邮箱的 UID
+#
+# - 在 UID 区间 lo:* 里搜索，不够一页再往前搜 lo2:lo-1，每次区间翻倍，凑够 起始编号 + 数量 封就停；
+#   没有筛选条件时 UID 基本是连续的，一般一次往返就够
+# - 服务器支持 ESEARCH 时用 RETURN (ALL)，结果以 1:500,502 这样的区间返回，比逐个列出短得多
+# - 非 ASCII 的条件用 CHARSET UTF-8 加 literal 发送；imaplib 一条命令只能带一个 literal，
+#   有多个这样的条件时分开搜索再取交集
+
+_ESEARCH_ALL = re.compile(rb'\bALL\s+([\d:,]+)', re.IGNORECASE)
+
+
+class SearchFilter:
+    def __init__(self, sender="", subject="", unseen=False, flagged=False):
+        self.sender = (sender or "").strip()
+        self.subject = (subject or "").strip()
+        self.unseen = unseen
+        self.flagged = flagged
+
+    def __bool__(self):
+        return bool(self.sender or self.subject or self.unseen or self.flagged)
+
+    # 搜索条件 [(关键字, 参数)]，参数为 None 表示这个关键字没有参数
+    def criteria(self):
+        criteria = []
+        if self.sender:
+            criteria.append(("FROM", self.sender))
+        if self.subject:
+            criteria.append(("SUBJECT", self.subject))
+        if self.unseen:
+            criteria.append(("UNSEEN", None))
+        if self.flagged:
+            criteria.append(("FLAGGED", None))
+        return criteria
+
+
+# 按日期搜索的条件，日期格式 YYYY-MM-DD；BEFORE 不包含当天
+def date_criteria(start_date=None, end_date=None):
+    criteria = []
+    if start_date:
+        criteria.append(("SINCE", datetime.strptime(start_date, "%Y-%m-%d").strftime("%d-%b-%Y")))
+    if end_date:
+        criteria.append(("BEFORE", datetime.strptime(end_date, "%Y-%m-%d").strftime("%d-%b-%Y")))
+    return criteria
+
+def _quote(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _is_ascii(value):
+    return value is None or value.isascii()
+
+# 执行一条 UID SEARCH，返回 UID 集合；literal 不为空时它作为最后一个条件的参数发送
+def _run_search(mail, tokens, literal=None):
+    esearch = has_capability(mail, 'ESEARCH')
+    prefix = ['RETURN', '(ALL)'] if esearch else []
+    if literal is not None:
+        prefix += ['CHARSET', 'UTF-8']
+        mail.literal = literal.encode('utf-8')
+    result, data = mail.uid('SEARCH', *prefix, *tokens)
+    if result != 'OK':
+        raise imaplib.IMAP4.error(f"UID SEARCH failed: {data!r}")
+    if esearch:
+        # 没有匹配时 ESEARCH 响应里没有 ALL
+        _, lines = mail.response('ESEARCH')
+        uids = set()
+        for line in lines or []:
+            match = _ESEARCH_ALL.search(line) if isinstance(line, bytes) else None
+            if match:
+                uids.update(parse_uid_set(match.group(1)))
+        return uids
+    return {int(uid) for uid in data[0].split()} if data and data[0] else set()
+
+# 按条件搜索当前选中的邮箱，criteria 是 [(关键字, 参数)]，返回从小到大的 UID 列表
+def search_uids(mail, criteria):
+    ascii_tokens = []
+    literal_criteria = []
+    for key, value in criteria:
+        if _is_ascii(value):
+            ascii_tokens.append(key)
+            if value is not None:
+                ascii_tokens.append(value if re.fullmatch(r'[\w:,*-]+', value, re.ASCII) else _quote(value))
+        else:
+            literal_criteria.append((key, value))
+    if not ascii_tokens:
+        ascii_tokens = ['ALL']
+
+    if not literal_criteria:
+        return sorted(_run_search(mail, ascii_tokens))
+
+    uids = None
+    for key, value in literal_criteria:
+        found = _run_search(mail, ascii_tokens + [key], literal=value)
+        uids = found if uids is None else uids & found
+        if not uids:
+            break
+    return sorted(uids)
+
+# 从小到大的 UID 列表里跳过最新的 start 封，取接下来的 limit 封；limit 不大于 0 时全部返回
+def page_uids(uids, limit, start=0):
+    if limit <= 0:
+        return uids
+    end = max(0, len(uids) - start)
+    return uids[max(0, end - limit):end]
+
+# 按条件从最新的邮件往前翻页：跳过最新的 start 封，返回接下来的 limit 封（从小到大）
+# uidnext 是 SELECT 时的 UIDNEXT，只用来估计第一个窗口的位置，过时也没关系
+def search_page(mail, criteria, limit, start=0, uidnext=None):
+    wanted = start + limit
+    if limit <= 0 or not uidnext:
+        return page_uids(search_uids(mail, criteria), limit, start)
+
+    matches = []
+    window = max(wanted, 16)
+    lo = max(1, uidnext - window)
+    # 第一个窗口到 *，新到的邮件也能搜到
+    hi = None
+    while True:
+        uid_range = f"{lo}:{hi if hi is not None else '*'}"
+        # UID lo:* 在 lo 大于最大 UID 时也会返回最后一封，需要再过滤一次
+        found = [uid for uid in search_uids(mail, [("UID", uid_range)] + list(criteria))
+                 if uid >= lo and (hi is None or uid <= hi)]
+        matches = found + matches
+        if len(matches) >= wanted or lo == 1:
+            break
+        hi = lo - 1
+        window *= 2
+        lo = max(1, hi - window + 1)
+
+    return page_uids(matches, limit, start)
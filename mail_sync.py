@@ -0,0 +1,111 @@
+import imaplib
+import re
+
+from imap_utils import has_capability, parse_fetch_response, parse_uid_set, quote_mailbox, select_mailbox
+from mail_query import search_uids
+
+# 增量同步：在本地缓存里记录每个邮箱现有的 UID 列表和 HIGHESTMODSEQ，加载时只问服务器“有什么变化”，
+# 不用每次 UID SEARCH ALL 列出整个邮箱
+#
+# - 服务器支持 CONDSTORE 时，STATUS 返回的 HIGHESTMODSEQ 没变就说明什么都没变，一次往返就结束；
+#   变了再用 UID FETCH 1:* (FLAGS) (CHANGEDSINCE n) 取出变化的邮件，启用了 QRESYNC 时顺便用 VANISHED 拿到被删除的 UID
+# - 不支持时按 UID 区间比较：UIDNEXT 和邮件数都没变就没有变化，否则只搜索 UIDNEXT 之后的新邮件，
+#   邮件数对不上（有邮件被删除）时才完整列一次 UID
+
+_STATUS_ITEM = re.compile(rb'([A-Z]+) (\d+)', re.IGNORECASE)
+
+
+# 登录并 refresh_capabilities 之后、SELECT 之前调用：服务器支持时启用 QRESYNC
+def enable_qresync(mail):
+    mail.qresync_enabled = False
+    if has_capability(mail, 'QRESYNC') and has_capability(mail, 'ENABLE'):
+        try:
+            result, _ = mail.enable('QRESYNC')
+            mail.qresync_enabled = result == 'OK'
+        except imaplib.IMAP4.error:
+            pass
+    return mail.qresync_enabled
+
+# 用 STATUS 查询邮箱状态（不需要 SELECT），返回 {"messages", "uidnext", "uidvalidity", "highestmodseq"} 中服务器给出的项
+def mailbox_status(mail, mailbox='inbox'):
+    items = "MESSAGES UIDNEXT UIDVALIDITY"
+    if has_capability(mail, 'CONDSTORE') or has_capability(mail, 'QRESYNC'):
+        items += " HIGHESTMODSEQ"
+    result, data = mail.status(quote_mailbox(mailbox), f"({items})")
+    line = data[-1] if result == 'OK' and data else None
+    if not isinstance(line, bytes):
+        raise imaplib.IMAP4.error(f"STATUS {mailbox} failed: {data!r}")
+    return {key.decode().lower(): int(value) for key, value in _STATUS_ITEM.findall(line[line.rfind(b'('):])}
+
+# 取出 modseq 之后变化过的邮件，返回 (变化的 UID, 删除的 UID)；没有启用 QRESYNC 时删除的 UID 为 None
+def _changes_since(mail, modseq):
+    qresync = getattr(mail, 'qresync_enabled', False)
+    modifier = f"(CHANGEDSINCE {modseq} VANISHED)" if qresync else f"(CHANGEDSINCE {modseq})"
+    result, data = mail.uid('FETCH', '1:*', f"(FLAGS) {modifier}")
+    if result != 'OK':
+        raise imaplib.IMAP4.error(f"UID FETCH CHANGEDSINCE failed: {data!r}")
+    changed = [int(fields["UID"]) for fields in parse_fetch_response(data) if fields.get("UID")]
+    if not qresync:
+        return changed, None
+
+    # VANISHED (EARLIER) 1:3,7；期间服务器主动推送的 VANISHED 也是被删除的邮件
+    vanished = []
+    _, lines = mail.response('VANISHED')
+    for line in lines or []:
+        if isinstance(line, bytes):
+            vanished.extend(parse_uid_set(re.sub(rb'^\(EARLIER\)\s*', b'', line.strip(), flags=re.IGNORECASE)))
+    return changed, vanished
+
+# 同步一个邮箱，返回 {"uidvalidity", "uids": 现有的全部 UID（从小到大）, "added", "vanished", "changed"}
+# 服务器不提供 UIDVALIDITY 时 UID 不可靠，返回 None，调用方应改用普通搜索
+def sync_mailbox(mail, cache, account, mailbox='inbox'):
+    status = mailbox_status(mail, mailbox)
+    uidvalidity = status.get("uidvalidity")
+    if uidvalidity is None:
+        return None
+
+    state = cache.get_sync_state(account, mailbox)
+    if state is None or state["uidvalidity"] != uidvalidity:
+        # 第一次同步，或者 UID 已经失效：完整列一次
+        cache.check_uidvalidity(account, mailbox, uidvalidity)
+        select_mailbox(mail, mailbox)
+        uids = search_uids(mail, [])
+        cache.save_sync(account, mailbox, status, added=uids, reset=True)
+        return {"uidvalidity": uidvalidity, "uids": uids, "added": uids, "vanished": [], "changed": []}
+
+    known = cache.get_mailbox_uids(account, mailbox)
+    modseq = status.get("highestmodseq")
+    if modseq is not None and state["highestmodseq"] is not None:
+        if modseq == state["highestmodseq"]:
+            return {"uidvalidity": uidvalidity, "uids": known, "added": [], "vanished": [], "changed": []}
+        select_mailbox(mail, mailbox)
+        changed, vanished = _changes_since(mail, state["highestmodseq"])
+        known_set = set(known)
+        added = [uid for uid in changed if uid not in known_set]
+        changed = [uid for uid in changed if uid in known_set]
+    else:
+        if (state["uidnext"] is not None and status.get("uidnext") == state["uidnext"]
+                and status.get("messages") == state["messages"]):
+            return {"uidvalidity": uidvalidity, "uids": known, "added": [], "vanished": [], "changed": []}
+        select_mailbox(mail, mailbox)
+        since = state["uidnext"] or (known[-1] + 1 if known else 1)
+        # UID n:* 在没有新邮件时也会返回最后一封，需要再过滤一次
+        added = [uid for uid in search_uids(mail, [("UID", f"{since}:*")]) if uid >= since]
+        changed, vanished = [], None
+        known_set = set(known)
+        added = [uid for uid in added if uid not in known_set]
+
+    if vanished is None:
+        # 不知道删除了哪些邮件：邮件数对得上就认为没有删除，否则完整列一次 UID 对比
+        if len(known) + len(added) == status.get("messages"):
+            vanished = []
+        else:
+            server_uids = search_uids(mail, [])
+            server_set = set(server_uids)
+            vanished = [uid for uid in known if uid not in server_set]
+            added = [uid for uid in server_uids if uid not in known_set]
+
+    vanished_set = set(vanished)
+    uids = sorted({uid for uid in known if uid not in vanished_set} | set(added))
+    cache.save_sync(account, mailbox, status, added=added, vanished=vanished)
+    return {"uidvalidity": uidvalidity, "uids": uids, "added": added, "vanished": vanished, "changed": changed}
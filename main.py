@@ -1,16 +1,36 @@
-import imaplib
+import startup_timer
 import email
 from email.header import decode_header
 from email.utils import parsedate_to_datetime
-from openai import OpenAI
 import os
 import sys
 import configparser
-import tkinter as tk
-from tkinter import ttk, messagebox
 import threading
 from datetime import datetime, timedelta
 import time
+from collections import defaultdict
+import queue
+import asyncio
+import json
+import functools
+from concurrent.futures import ThreadPoolExecutor
+startup_timer.mark("stdlib imports")
+
+from imap_utils import (build_uid_set, parse_fetch_uid, parse_fetch_response, find_text_part, idle_wait, parse_idle_events,
+                        select_mailbox)
+from mail_cache import MailCache, ClassificationMemo, content_fingerprint
+from search_index import SearchIndex
+from threads import ThreadIndex, group_threads, member_key, thread_records
+from rate_limit import RateLimiter
+from pipeline import BackgroundLoop, run_pipeline
+from rules import RuleEngine
+from local_model import LocalClassifier
+from accounts import load_mail_accounts
+from mail_sync import sync_mailbox
+from mail_query import SearchFilter, date_criteria, page_uids, search_page, search_uids
+from text_utils import estimate_tokens, html_to_text, clean_content, truncate_to_tokens
+from metrics import Metrics
+startup_timer.mark("local modules")
 
 # 加载配置文件
 # 获取当前程序目录
@@ -24,64 +44,247 @@ def resource_path(relative_path):
 
     return os.path.join(base_path, relative_path)
 
+# 程序产生的数据文件（缓存等）放在可执行文件旁边，不能放进 PyInstaller 的临时目录
+def data_path(relative_path):
+    if getattr(sys, 'frozen', False):
+        base_path = os.path.dirname(sys.executable)
+    else:
+        base_path = os.path.abspath(".")
+
+    return os.path.join(base_path, relative_path)
+
 # 加载配置文件
 config_path = resource_path('.config')
 config = configparser.ConfigParser()
 config.read(config_path)
 
 
-# IMAP配置
-IMAP_SERVER = config['EMAIL']['IMAP_SERVER']
+# IMAP配置，[EMAIL] 是第一个账号；其他账号见 accounts.py
 EMAIL_ACCOUNT = config['EMAIL']['EMAIL_ACCOUNT']
-EMAIL_PASSWORD = config['EMAIL']['EMAIL_PASSWORD']
 
 # OpenAI API配置
-client = OpenAI(api_key=config['OPENAI']['API_KEY'])
-
-# 连接IMAP服务器
+# openai 库导入很慢，启动时不导入，第一次调用 API 时（或者窗口出现后在后台）才导入并创建客户端
+OPENAI_API_KEY = config['OPENAI']['API_KEY']
+# 兼容 OpenAI 接口的其他服务地址，不填使用官方地址
+OPENAI_BASE_URL = config.get('OPENAI', 'BASE_URL', fallback=None) or None
+async_client = None
+openai_lock = threading.Lock()
+
+# 导入 openai 之前的占位，不会被抛出；load_openai() 之后换成 openai.RateLimitError
+class RateLimitError(Exception):
+    pass
+
+def load_openai():
+    global async_client, RateLimitError
+    with openai_lock:
+        if async_client is None:
+            from openai import AsyncOpenAI, RateLimitError
+            # 关掉 SDK 自带的重试：429 由下面的 MAX_RETRIES 退避和限流器统一处理，否则每次重试都不经过限流器
+            async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0)
+    return async_client
+
+def get_async_client():
+    if async_client is None:
+        load_openai()
+    return async_client
+
+MODEL = config.get('OPENAI', 'MODEL', fallback='gpt-4o-mini')
+# 同时进行的分类请求数，以及每分钟请求数/token 数上限（0 表示不限制）
+CLASSIFY_WORKERS = config.getint('OPENAI', 'WORKERS', fallback=8)
+REQUESTS_PER_MINUTE = config.getint('OPENAI', 'REQUESTS_PER_MINUTE', fallback=500)
+TOKENS_PER_MINUTE = config.getint('OPENAI', 'TOKENS_PER_MINUTE', fallback=200000)
+MAX_RETRIES = config.getint('OPENAI', 'MAX_RETRIES', fallback=5)
+# 一次请求最多分类几封邮件（1 表示一封一封分类），以及一批邮件的估计 token 上限
+BATCH_SIZE = config.getint('OPENAI', 'BATCH_SIZE', fallback=1)
+BATCH_MAX_TOKENS = config.getint('OPENAI', 'BATCH_MAX_TOKENS', fallback=8000)
+# 一封一封分类时使用流式输出，类型和重要级一出来就先显示这一行，总结和日程边生成边补上
+STREAM = config.getboolean('OPENAI', 'STREAM', fallback=True)
+
+# IMAP拉取配置，每条 UID FETCH 命令携带的邮件数量
+FETCH_CHUNK_SIZE = config.getint('EMAIL', 'FETCH_CHUNK_SIZE', fallback=100)
+# 拉取完还没分类的批最多保留多少个，排满时暂停拉取，内存占用大约是 FETCH_CHUNK_SIZE 封加上这么多批
+PIPELINE_BUFFER = config.getint('EMAIL', 'PIPELINE_BUFFER', fallback=64)
+# 按回复关系把邮件归成会话，一个会话一行、只分类一次，有新回复时增量更新
+GROUP_THREADS = config.getboolean('EMAIL', 'GROUP_THREADS', fallback=True)
+# partial: 先拉邮件头和 BODYSTRUCTURE，再只拉正文部件的前 TEXT_BYTE_LIMIT 字节；full: 拉完整的 RFC822
+FETCH_MODE = config.get('EMAIL', 'FETCH_MODE', fallback='partial').strip().lower()
+TEXT_BYTE_LIMIT = config.getint('EMAIL', 'TEXT_BYTE_LIMIT', fallback=16384)
+# 正文交给模型前最多保留的估计 token 数，0 表示不截断
+CONTENT_TOKEN_BUDGET = config.getint('EMAIL', 'CONTENT_TOKEN_BUDGET', fallback=1500)
+
+# 本地缓存配置
+CACHE_ENABLED = config.getboolean('CACHE', 'ENABLED', fallback=True)
+CACHE_PATH = config.get('CACHE', 'PATH', fallback='mail_cache.db')
+MEMO_SIZE = config.getint('CACHE', 'MEMO_SIZE', fallback=1024)
+MEMO_TTL = config.getint('CACHE', 'MEMO_TTL', fallback=86400)
+
+# 本地全文索引，分类完成的邮件写入索引，之后可以不联网搜索；LIMIT 是一次最多显示的结果数
+SEARCH_ENABLED = config.getboolean('SEARCH', 'ENABLED', fallback=True)
+SEARCH_PATH = config.get('SEARCH', 'PATH', fallback='mail_index.db')
+SEARCH_LIMIT = config.getint('SEARCH', 'LIMIT', fallback=200)
+
+# 运行指标（各阶段耗时、请求数、重试次数、token 用量、队列长度），可以导出为 JSON 或 Prometheus 文本
+# 扩展名为 .json 时导出 JSON；EXPORT_INTERVAL 大于 0 时每隔这么多秒自动导出一次
+METRICS_PATH = config.get('METRICS', 'PATH', fallback='metrics.prom')
+METRICS_EXPORT_INTERVAL = config.getint('METRICS', 'EXPORT_INTERVAL', fallback=0)
+metrics = Metrics()
+
+# partial 模式下拉取的邮件头字段
+HEADER_FIELDS = (
+    "FROM", "TO", "CC", "SUBJECT", "DATE", "MESSAGE-ID", "IN-REPLY-TO", "REFERENCES",
+    "LIST-ID", "LIST-UNSUBSCRIBE", "PRECEDENCE",
+)
+
+# 连接池大小和空闲连接 NOOP 保活的间隔（秒）
+POOL_SIZE = config.getint('EMAIL', 'POOL_SIZE', fallback=2)
+KEEPALIVE = config.getint('EMAIL', 'KEEPALIVE', fallback=240)
+
+# 所有邮箱账号，每个账号有自己的连接池
+mail_accounts = load_mail_accounts(config, POOL_SIZE, KEEPALIVE)
+
+# 连接第一个账号的IMAP服务器
 def connect_imap():
-    mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-    mail.login(EMAIL_ACCOUNT, EMAIL_PASSWORD)
-    return mail
+    return mail_accounts[0].connect()
 
-# 拉取指定范围内的邮件
-def fetch_emails(mail, limit=3, start=0, start_date=None, end_date=None):
-    mail.select('inbox')
+# 用 CONDSTORE/QRESYNC 或 UID 区间增量同步邮箱，需要开启缓存
+INCREMENTAL_SYNC = config.getboolean('EMAIL', 'INCREMENTAL_SYNC', fallback=True)
 
-    # 按日期或数量拉取邮件
-    if start_date and end_date:
-        # 按日期拉取，构造 IMAP 搜索条件
-        since_date = datetime.strptime(start_date, "%Y-%m-%d").strftime("%d-%b-%Y")
-        before_date = datetime.strptime(end_date, "%Y-%m-%d").strftime("%d-%b-%Y")
-        result, data = mail.search(None, f'SINCE {since_date}', f'BEFORE {before_date}')
-    else:
-        # 按数量拉取
-        result, data = mail.search(None, 'ALL')
+# 实时监听：每次 IDLE 的最长时间，以及出错后重新连接前的等待时间（秒）
+IDLE_TIMEOUT = config.getint('EMAIL', 'IDLE_TIMEOUT', fallback=29 * 60)
+IDLE_RECONNECT_DELAY = config.getint('EMAIL', 'IDLE_RECONNECT_DELAY', fallback=30)
 
-    if result != 'OK':
-        return []
+# 按块批量拉取邮件，每块只需要一次往返
+def fetch_messages_by_uid(mail, uids, chunk_size=None):
+    chunk_size = max(1, chunk_size or FETCH_CHUNK_SIZE)
+    uids = [int(uid) for uid in uids]
+    messages = {}
 
-    email_ids = data[0].split()
-    
-    # 如果是按数量拉取，限制邮件数量
-    if not start_date and not end_date:
-        email_ids = email_ids[-limit:] if limit > 0 else email_ids
+    for i in range(0, len(uids), chunk_size):
+        chunk = uids[i:i + chunk_size]
+        try:
+            result, message_data = mail.uid('FETCH', build_uid_set(chunk), '(RFC822)')
+            if result != 'OK':
+                continue
 
-    emails = []
+            for item in message_data:
+                # 响应由 (b'1 (UID 123 RFC822 {size}', 原始邮件) 元组和 b')' 组成
+                if not isinstance(item, tuple):
+                    continue
+                uid = parse_fetch_uid(item[0])
+                if uid is not None:
+                    messages[uid] = email.message_from_bytes(item[1])
 
-    for email_id in email_ids:
+        except Exception as e:
+            print(f"Error fetching email UIDs {chunk[0]}-{chunk[-1]}: {e}")
+
+    # 服务器返回的顺序不一定和请求一致，按请求的 UID 顺序返回 {uid: 邮件}
+    return {uid: messages[uid] for uid in uids if uid in messages}
+
+# 用邮件头和截断后的正文部件拼出一封只有正文的邮件，extract_* 函数可以照常使用
+def build_partial_message(header_bytes, text_part=None, body=b''):
+    lines = [header_bytes.rstrip(b'\r\n')] if header_bytes and header_bytes.strip() else []
+
+    if text_part:
+        _, info = text_part
+        content_type = info["content_type"]
+        charset = info["params"].get("charset")
+        if charset:
+            content_type += f'; charset="{charset}"'
+        lines.append(f"Content-Type: {content_type}".encode())
+
+        encoding = info["encoding"]
+        if encoding in ("base64", "quoted-printable", "7bit", "8bit", "binary"):
+            lines.append(f"Content-Transfer-Encoding: {encoding}".encode())
+        if encoding == "base64":
+            # 截断可能落在 4 字节组中间，去掉不完整的尾巴
+            body = b''.join(body.split())
+            body = body[:len(body) - len(body) % 4]
+
+    return email.message_from_bytes(b'\r\n'.join(lines) + b'\r\n\r\n' + (body or b''))
+
+def _fetch_field(fields, prefix):
+    for key, value in fields.items():
+        if key.startswith(prefix):
+            return bytes(value) if value else b''
+    return b''
+
+# 先拉邮件头和 BODYSTRUCTURE，再只拉正文部件的前 byte_limit 字节，附件不会被下载
+# 全部使用 BODY.PEEK，不会把邮件标记为已读
+def fetch_messages_partial(mail, uids, chunk_size=None, byte_limit=None):
+    chunk_size = max(1, chunk_size or FETCH_CHUNK_SIZE)
+    byte_limit = byte_limit or TEXT_BYTE_LIMIT
+    uids = [int(uid) for uid in uids]
+    header_query = f"(BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})])"
+
+    headers = {}
+    text_parts = {}
+    for i in range(0, len(uids), chunk_size):
+        chunk = uids[i:i + chunk_size]
         try:
-            result, message_data = mail.fetch(email_id, '(RFC822)')
+            result, message_data = mail.uid('FETCH', build_uid_set(chunk), header_query)
             if result != 'OK':
                 continue
 
-            msg = email.message_from_bytes(message_data[0][1])
-            emails.append(msg)
+            for fields in parse_fetch_response(message_data):
+                if not fields.get("UID"):
+                    continue
+                uid = int(fields["UID"])
+                headers[uid] = _fetch_field(fields, "BODY[HEADER")
+                text_part = find_text_part(fields.get("BODYSTRUCTURE"), ("text/plain", "text/html"))
+                if text_part:
+                    text_parts[uid] = text_part
 
         except Exception as e:
-            print(f"Error fetching email ID {email_id}: {e}")
+            print(f"Error fetching headers for UIDs {chunk[0]}-{chunk[-1]}: {e}")
 
-    return emails
+    # 正文部件编号相同的邮件可以合并在一条命令里拉取
+    uids_by_section = defaultdict(list)
+    for uid, (number, _) in text_parts.items():
+        uids_by_section[number].append(uid)
+
+    bodies = {}
+    for number, section_uids in uids_by_section.items():
+        for i in range(0, len(section_uids), chunk_size):
+            chunk = section_uids[i:i + chunk_size]
+            try:
+                result, message_data = mail.uid('FETCH', build_uid_set(chunk), f"(BODY.PEEK[{number}]<0.{byte_limit}>)")
+                if result != 'OK':
+                    continue
+
+                for fields in parse_fetch_response(message_data):
+                    if fields.get("UID"):
+                        bodies[int(fields["UID"])] = _fetch_field(fields, f"BODY[{number}]")
+
+            except Exception as e:
+                print(f"Error fetching body part {number} for UIDs {chunk[0]}-{chunk[-1]}: {e}")
+
+    return {uid: build_partial_message(headers[uid], text_parts.get(uid), bodies.get(uid, b''))
+            for uid in uids if uid in headers}
+
+# 按块拉取邮件，每拉完一块就交出这一块 {uid: 邮件}，调用方处理完再拉下一块，内存里只有一块邮件
+def iter_messages(mail, uids, chunk_size=None, mode=None):
+    chunk_size = max(1, chunk_size or FETCH_CHUNK_SIZE)
+    for i in range(0, len(uids), chunk_size):
+        yield fetch_messages(mail, uids[i:i + chunk_size], chunk_size, mode)
+
+# 在当前选择的邮箱里搜索，返回从小到大的 UID 列表；筛选条件（search_filter）和日期都交给服务器过滤
+# 按日期搜索时返回全部结果；按数量搜索时跳过最新的 start 封，返回接下来的 limit 封；指定 since_uid 时返回比它大的所有 UID
+def search_email_uids(mail, limit=3, start=0, start_date=None, end_date=None, since_uid=None, search_filter=None):
+    if since_uid is not None:
+        # UID n:* 在没有新邮件时也会返回最后一封，需要再过滤一次
+        return [uid for uid in search_uids(mail, [("UID", f"{since_uid + 1}:*")]) if uid > since_uid]
+
+    criteria = (search_filter.criteria() if search_filter else []) + date_criteria(start_date, end_date)
+    if start_date and end_date:
+        return search_uids(mail, criteria)
+    # 按数量拉取：从最新的邮件开始按 UID 窗口往前搜索，不用列出整个邮箱
+    return search_page(mail, criteria, limit, start, getattr(mail, 'selected_uidnext', None))
+
+# 按 UID 拉取邮件，返回 {uid: 邮件}
+def fetch_messages(mail, uids, chunk_size=None, mode=None):
+    if (mode or FETCH_MODE) == 'full':
+        return fetch_messages_by_uid(mail, uids, chunk_size)
+    return fetch_messages_partial(mail, uids, chunk_size)
 
 
 # 解码邮件头字段
@@ -110,36 +313,114 @@ def extract_email_headers(msg):
         "收件人": to_addr,
         "抄送": cc_addr,
         "主题": subject,
-        "日期": date
+        "日期": date,
+        # 多个账号、文件夹里的同一封邮件按它去重
+        "Message-ID": msg.get("Message-ID", "").strip(),
+        # 按回复关系把邮件归到会话
+        "In-Reply-To": msg.get("In-Reply-To", ""),
+        "References": msg.get("References", ""),
+        # 规则判断群发邮件时使用
+        "List-Id": msg.get("List-Id", ""),
+        "List-Unsubscribe": msg.get("List-Unsubscribe", ""),
+        "Precedence": msg.get("Precedence", ""),
     }
     return headers
 
-# 提取邮件内容
+# 解码单个部件的正文，按部件声明的字符集解码，HTML 转成纯文本
+def decode_part_text(part):
+    payload = part.get_payload(decode=True)
+    if not payload:
+        return ""
+    charset = part.get_content_charset() or 'utf-8'
+    try:
+        text = payload.decode(charset, errors='ignore')
+    except LookupError:
+        text = payload.decode('utf-8', errors='ignore')
+    if part.get_content_type() == "text/html":
+        text = html_to_text(text)
+    return text
+
+# 提取邮件内容：优先 text/plain，没有时使用 text/html；去掉引用、签名和页脚后按 token 预算截断
 def extract_email_content(msg):
+    text = ""
     if msg.is_multipart():
-        for part in msg.walk():
-            if part.get_content_type() == "text/plain" and part.get_content_disposition() != "attachment":
-                return part.get_payload(decode=True).decode(errors='ignore')
+        parts = [part for part in msg.walk() if part.get_content_disposition() != "attachment"]
+        for content_type in ("text/plain", "text/html"):
+            part = next((part for part in parts if part.get_content_type() == content_type), None)
+            if part is not None:
+                text = decode_part_text(part)
+                break
+    elif msg.get_content_maintype() == "text":
+        text = decode_part_text(msg)
+
+    return truncate_to_tokens(clean_content(text), CONTENT_TOKEN_BUDGET)
+
+# 拉取邮件并转换成记录 {"account", "uid", "mailbox", "uidvalidity", "headers", "content", "classification"}
+# 有缓存时先查缓存，只去服务器拉取缓存里没有的邮件；已经分类过的邮件 classification 不为空
+# 生成器，一块一块地交出记录列表：先是缓存里有的，然后从最新的邮件开始每拉取一块交出一块；
+# 原始邮件（包括附件）在提取出邮件头和正文后就释放，占用的内存取决于块大小而不是邮件总数
+def iter_email_records(mail, cache=None, mailbox='inbox', limit=3, start=0, start_date=None, end_date=None, since_uid=None,
+                       account=None, search_filter=None, uids=None):
+    account = account or EMAIL_ACCOUNT
+    sync = None
+    if cache and INCREMENTAL_SYNC and not (start_date and end_date) and since_uid is None and not search_filter \
+            and uids is None:
+        # 按数量加载时使用增量同步的 UID 列表，不用每次 SEARCH ALL
+        with metrics.timer("imap_sync"):
+            sync = sync_mailbox(mail, cache, account, mailbox)
+
+    if sync is not None:
+        uidvalidity = sync["uidvalidity"]
+        email_uids = page_uids(sync["uids"], limit, start)
     else:
-        return msg.get_payload(decode=True).decode(errors='ignore') if msg.get_payload() else ""
-    return ""
-
-# 调用OpenAI API进行分类
-def classify_email(headers, content):
-    combined_content = f"""
-    发件人: {headers['发件人']}
-    收件人: {headers['收件人']}
-    抄送: {headers['抄送']}
-    主题: {headers['主题']}
-    日期: {headers['日期']}
-    内容: {content}
-    """
-
-    response = client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": "你是一个日程智能助理，下面是一封邮件，请根据邮件的内容进行以下分类和判断：\n\n\
+        with metrics.timer("imap_search"):
+            uidvalidity = select_mailbox(mail, mailbox)
+            # 指定 uids 时直接拉取这些邮件，不再搜索
+            email_uids = uids if uids is not None else search_email_uids(
+                mail, limit=limit, start=start, start_date=start_date, end_date=end_date,
+                since_uid=since_uid, search_filter=search_filter)
+
+    # 服务器不提供 UIDVALIDITY 时 UID 不可靠，不使用缓存
+    if uidvalidity is None:
+        cache = None
+
+    cached_uids = set()
+    if cache:
+        cache.check_uidvalidity(account, mailbox, uidvalidity)
+        cached = [dict(cached, account=account, uid=uid, mailbox=mailbox, uidvalidity=uidvalidity)
+                  for uid, cached in cache.get_messages(account, mailbox, uidvalidity, email_uids).items()]
+        metrics.inc("cache_hits", len(cached))
+        if cached:
+            cached_uids = {record["uid"] for record in cached}
+            yield cached
+
+    # 从最新的邮件开始拉取，最新的几封最先显示出来
+    missing_uids = [uid for uid in reversed(email_uids) if uid not in cached_uids]
+    if missing_uids:
+        select_mailbox(mail, mailbox)
+    messages = iter_messages(mail, missing_uids)
+    while True:
+        with metrics.timer("imap_fetch"):
+            chunk = next(messages, None)
+        if chunk is None:
+            break
+        metrics.inc("emails_fetched", len(chunk))
+        records = []
+        for uid in list(chunk):
+            msg = chunk.pop(uid)
+            with metrics.timer("parse"):
+                headers = extract_email_headers(msg)
+                content = extract_email_content(msg)
+            if cache:
+                cache.save_message(account, mailbox, uidvalidity, uid, headers, content)
+            records.append({
+                "account": account, "uid": uid, "mailbox": mailbox, "uidvalidity": uidvalidity,
+                "headers": headers, "content": content, "classification": None,
+            })
+        yield records
+
+# 分类用的系统提示词
+SYSTEM_PROMPT = "你是一个日程智能助理，下面是一封邮件，请根据邮件的内容进行以下分类和判断：\n\n\
                     1. 判断邮件的类型（活动宣传、学校事务、学术信息、垃圾邮件、日常通知等）。\n\
                     2. 评估邮件的重要级别，包括以下几类：“必须完成”、“重要通知”、“一般通知”、“回复必要”等。 如果只是讲座或者活动或者宣传等请标记为一般通知。 如果是学校事务例如 极端天气，调课，放假，施工，是重要。\n\
                     3. 如果邮件需要回复，请总结回复的关键点。\n\
@@ -151,19 +432,613 @@ def classify_email(headers, content):
                     收件人(我 tacoin或者wangzq开头的就是我，或者是全体本科生/xx书院之类的)\n\
                     总结: 总结邮件内容，用几句话描述邮件的主要内容。\n\
                     日程: (例如：2024年11月6日 13:00 在xxx举办 xxx活动)"
-            },
-            {
-                "role": "user",
-                "content": combined_content
-            }
-        ],
-        model="gpt-4o-mini",
+
+# 所有分类请求共用的限流器
+rate_limiter = RateLimiter(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)
+
+# 构造分类请求的消息列表，同时估计这次请求要消耗的 token 数
+def build_classification_messages(headers, content):
+    combined_content = f"""
+    发件人: {headers['发件人']}
+    收件人: {headers['收件人']}
+    抄送: {headers['抄送']}
+    主题: {headers['主题']}
+    日期: {headers['日期']}
+    内容: {content}
+    """
+
+    messages = [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": combined_content
+        }
+    ]
+    # 输入 token 加上大约 300 个输出 token
+    estimated_tokens = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(combined_content) + 300
+    return messages, estimated_tokens
+
+# 记录一次 API 请求：耗时、请求数和返回的 token 用量
+def record_api_call(started, response):
+    metrics.observe("llm_request", time.perf_counter() - started)
+    metrics.inc("llm_requests")
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        metrics.inc("prompt_tokens", usage.prompt_tokens or 0)
+        metrics.inc("completion_tokens", usage.completion_tokens or 0)
+
+# 被限流 (429) 时记录，最后一次重试也失败时返回 False
+def record_rate_limited(attempt):
+    metrics.inc("llm_rate_limited")
+    if attempt == MAX_RETRIES:
+        return False
+    metrics.inc("llm_retries")
+    return True
+
+# 从还没生成完的分类文本里解析出已经能确定的字段：类型、重要级等只取已经完整的行，
+# 总结和日程可以用正在生成的最后一行；类型和重要级都还不知道时返回 None
+def parse_partial_classification(text):
+    complete, _, last_line = text.rpartition("\n")
+    info = dict(zip(CLASSIFICATION_FIELDS, parse_classification(complete)))
+    for key in ("总结", "日程"):
+        if last_line.startswith(f"{key}:"):
+            info[key] = last_line[len(key)+1:].strip()
+    if not info["类型"] or not info["重要级"]:
+        return None
+    return info
+
+# 流式接收分类结果，每收到一段就把能确定的字段交给 on_partial(info)，返回完整的分类文本
+async def stream_classification(messages, on_partial):
+    started = time.perf_counter()
+    stream = await get_async_client().chat.completions.create(
+        messages=messages, model=MODEL, stream=True, stream_options={"include_usage": True},
+    )
+    text = ""
+    last_info = None
+    usage_chunk = None
+    async for chunk in stream:
+        # 最后一个数据块没有 choices，只带本次请求的 token 用量
+        if getattr(chunk, "usage", None) is not None:
+            usage_chunk = chunk
+        if not chunk.choices:
+            continue
+        delta = getattr(chunk.choices[0].delta, "content", None) or ""
+        if not delta:
+            continue
+        if not text:
+            metrics.observe("llm_first_token", time.perf_counter() - started)
+        text += delta
+        info = parse_partial_classification(text)
+        if info is not None and info != last_info:
+            if last_info is None:
+                metrics.observe("llm_first_priority", time.perf_counter() - started)
+            last_info = info
+            on_partial(info)
+    record_api_call(started, usage_chunk)
+    return text
+
+# 调用 OpenAI API 进行分类，给后台流水线使用；传入 on_partial 并且开启了 STREAM 时流式接收结果
+async def classify_email_async(headers, content, on_partial=None):
+    messages, estimated_tokens = build_classification_messages(headers, content)
+
+    for attempt in range(MAX_RETRIES + 1):
+        with metrics.timer("rate_limit_wait"):
+            await rate_limiter.acquire_async(estimated_tokens)
+        try:
+            if STREAM and on_partial is not None:
+                return await stream_classification(messages, on_partial)
+            started = time.perf_counter()
+            response = await get_async_client().chat.completions.create(messages=messages, model=MODEL)
+            record_api_call(started, response)
+            return response.choices[0].message.content
+
+        except RateLimitError:
+            if not record_rate_limited(attempt):
+                raise
+            rate_limiter.pause(min(60, 2 ** attempt))
+
+# parse_classification 解析出的字段
+CLASSIFICATION_FIELDS = ("类型", "重要级", "发件人", "收件人", "总结", "日程")
+
+# 规则快速分类，命中规则的邮件不调用 API
+rule_engine = RuleEngine.from_config(config)
+
+# 用模型历史标签训练的本地分类器，有把握的常规邮件不调用 API
+LOCAL_MODEL_ENABLED = config.getboolean('LOCAL_MODEL', 'ENABLED', fallback=True)
+local_model = LocalClassifier.from_config(config)
+
+# 重复投递的同一封通知只分类一次，按数量、按日期和实时监听共用
+classification_memo = ClassificationMemo(MEMO_SIZE, MEMO_TTL)
+
+# 邮件会话的归属和每个会话上次的分类结果
+thread_index = ThreadIndex()
+
+# 带内容指纹缓存的分类；count=False 表示调用方已经查过缓存并计入统计
+async def classify_email_cached_async(headers, content, on_partial=None, count=True):
+    key = content_fingerprint(headers['主题'], content)
+    return await classification_memo.get_or_compute_async(
+        key, lambda: classify_email_async(headers, content, on_partial), count)
+
+# 多封邮件一起分类时用的系统提示词，要求返回 JSON
+BATCH_SYSTEM_PROMPT = """你是一个日程智能助理，下面是多封邮件，每封邮件以 "=== 邮件 id ===" 开头。请对每封邮件分别进行以下分类和判断：
+
+1. 判断邮件的类型（活动宣传、学校事务、学术信息、垃圾邮件、日常通知等）。
+2. 评估邮件的重要级别，包括以下几类：“必须完成”、“重要通知”、“一般通知”、“回复必要”等。 如果只是讲座或者活动或者宣传等请标记为一般通知。 如果是学校事务例如 极端天气，调课，放假，施工，是重要。
+3. 如果邮件需要回复，请总结回复的关键点。
+4. 提取日程信息，包括日期和时间（例如：xx月xx日 xx时-xx时），以及活动的地点和主题（例如，2024年11月6日 13:00 在xxx举办xxx活动）。
+
+只输出一个 JSON 对象，格式如下，results 里每封邮件一项，id 和邮件开头的 id 一致，没有日程时 日程 为空字符串：
+{"results": [{"id": "1", "类型": "xxx", "重要级": "xxx", "发件人": "xxx", "收件人": "xxx(我 tacoin或者wangzq开头的就是我，或者是全体本科生/xx书院之类的)", "总结": "用几句话描述邮件的主要内容", "日程": "例如：2024年11月6日 13:00 在xxx举办 xxx活动"}]}"""
+
+# 每封邮件大约需要的输出 token 数
+OUTPUT_TOKENS_PER_EMAIL = 300
+
+# 单封邮件在分类请求里的估计 token 数
+def estimate_email_tokens(record):
+    headers = record["headers"]
+    return estimate_tokens(headers["发件人"] + headers["收件人"] + headers["抄送"] + headers["主题"] + record["content"]) + 50
+
+# 按封数和估计 token 数把记录分批，已经有分类结果的记录单独成批，不占用批次名额
+def make_classification_batches(records, batch_size=None, max_tokens=None):
+    batch_size = max(1, batch_size or BATCH_SIZE)
+    max_tokens = max_tokens or BATCH_MAX_TOKENS
+    batches = []
+    batch = []
+    batch_tokens = 0
+
+    for record in records:
+        if record["classification"] is not None:
+            batches.append([record])
+            continue
+
+        tokens = estimate_email_tokens(record) + OUTPUT_TOKENS_PER_EMAIL
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(record)
+        batch_tokens += tokens
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+# 把 JSON 结果转换成单封分类返回的文本格式，后续统一交给 parse_classification 解析
+def format_classification(result):
+    lines = []
+    for key in CLASSIFICATION_FIELDS:
+        value = str(result.get(key) or "").replace("\n", " ").strip()
+        if value:
+            lines.append(f"{key}: {value}")
+    return "\n".join(lines)
+
+# 解析批量分类的 JSON 输出，返回 {id: 文本格式的分类结果}，格式不对时返回空字典
+def parse_batch_classification(text):
+    text = (text or "").strip()
+    # 去掉模型偶尔加上的 ```json 代码块标记
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find("{"):]
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return {}
+
+    results = data.get("results") if isinstance(data, dict) else data
+    if not isinstance(results, list):
+        return {}
+    return {str(item["id"]): format_classification(item)
+            for item in results if isinstance(item, dict) and "id" in item}
+
+# 一次请求分类多封邮件，items 是 [(邮件头, 正文)]，返回和 items 对应的文本分类结果，失败的位置为 None
+async def classify_emails_batch_async(items):
+    parts = []
+    estimated_tokens = estimate_tokens(BATCH_SYSTEM_PROMPT)
+    for i, (headers, content) in enumerate(items, 1):
+        part = f"""=== 邮件 {i} ===
+发件人: {headers['发件人']}
+收件人: {headers['收件人']}
+抄送: {headers['抄送']}
+主题: {headers['主题']}
+日期: {headers['日期']}
+内容: {content}
+"""
+        parts.append(part)
+        estimated_tokens += estimate_tokens(part) + OUTPUT_TOKENS_PER_EMAIL
+
+    messages = [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": "\n".join(parts)},
+    ]
+
+    for attempt in range(MAX_RETRIES + 1):
+        with metrics.timer("rate_limit_wait"):
+            await rate_limiter.acquire_async(estimated_tokens)
+        try:
+            started = time.perf_counter()
+            response = await get_async_client().chat.completions.create(
+                messages=messages, model=MODEL, response_format={"type": "json_object"},
+            )
+            record_api_call(started, response)
+            break
+        except RateLimitError:
+            if not record_rate_limited(attempt):
+                raise
+            rate_limiter.pause(min(60, 2 ** attempt))
+
+    results = parse_batch_classification(response.choices[0].message.content)
+    return [results.get(str(i)) for i in range(1, len(items) + 1)]
+
+# 批量分类，先查内容指纹缓存；批量结果缺失或格式不对的邮件退回单封分类
+# 单封分类的邮件会把流式得到的部分结果交给 on_partial(序号, info)
+async def classify_emails_cached_async(items, on_partial=None):
+    def partial_for(i):
+        return None if on_partial is None else functools.partial(on_partial, i)
+
+    if len(items) == 1:
+        return [await classify_email_cached_async(*items[0], partial_for(0))]
+
+    keys = [content_fingerprint(headers['主题'], content) for headers, content in items]
+    classifications = [classification_memo.get(key) for key in keys]
+    missing = [i for i, classification in enumerate(classifications) if classification is None]
+
+    if len(missing) > 1:
+        try:
+            batch_results = await classify_emails_batch_async([items[i] for i in missing])
+        except RateLimitError:
+            raise
+        except Exception as e:
+            print(f"Batch classification failed, falling back to single emails: {e}")
+            batch_results = [None] * len(missing)
+        for i, classification in zip(missing, batch_results):
+            if classification:
+                classifications[i] = classification
+                classification_memo.put(keys[i], classification)
+
+    # 剩下的一封一封分类，上面的 get() 已经统计过这些邮件的缓存查找
+    fallback = [i for i, classification in enumerate(classifications) if classification is None]
+    singles = await asyncio.gather(*(classify_email_cached_async(*items[i], partial_for(i), count=False)
+                                     for i in fallback))
+    for i, classification in zip(fallback, singles):
+        classifications[i] = classification
+    return classifications
+
+# 先用规则和本地模型分类，分别统计缓存、规则和本地模型直接给出分类结果的邮件数
+def classify_locally(records):
+    def unclassified():
+        return sum(1 for record in records if record["classification"] is None)
+    pending = unclassified()
+    metrics.inc("classified_cache", len(records) - pending)
+    rule_engine.apply(records)
+    metrics.inc("classified_rule", pending - unclassified())
+    if LOCAL_MODEL_ENABLED:
+        pending = unclassified()
+        local_model.apply(records)
+        metrics.inc("classified_local", pending - unclassified())
+    return records
+
+# 一块一块地拉取邮件记录并先在本地分类（阻塞，在后台线程里迭代），交给 run_pipeline 时拉一块分类一块
+# 默认用第一个账号；不指定连接时使用账号的连接池；GROUP_THREADS 时每块里同一个会话的邮件合并成一条记录
+# 传入 dedupe 时分组之前先用它去掉别的拉取函数已经交出过的邮件（见 make_dedupe）
+def iter_records(cache=None, mail=None, mail_account=None, dedupe=None, **search):
+    mail_account = mail_account or mail_accounts[0]
+    if mail is None:
+        chunks = mail_account.pool.stream(lambda mail: iter_email_records(mail, cache, account=mail_account.user,
+                                                                          **search))
+    else:
+        chunks = iter_email_records(mail, cache, account=mail_account.user, **search)
+    for records in chunks:
+        if dedupe:
+            records = dedupe(records)
+        if GROUP_THREADS:
+            records = group_threads(thread_index.assign(records, cache))
+        yield classify_locally(records)
+
+# 一次拉取全部邮件记录并先在本地分类
+def load_records(cache=None, mail=None, mail_account=None, **search):
+    records = [record for chunk in iter_records(cache, mail, mail_account, **search) for record in chunk]
+    return sorted(records, key=lambda record: record["uid"])
+
+# 实时监听：在监听连接上拉取 UID 大于 last_uid 的新邮件，返回 (记录列表, 新的 last_uid)
+# last_uid 只推进到第一封没有得到记录的邮件之前，某一块拉取失败时这些邮件下次再拉，不会被跳过
+def load_new_records(cache, mail, last_uid, mailbox='inbox'):
+    select_mailbox(mail, mailbox)
+    uids = search_email_uids(mail, since_uid=last_uid)
+    if not uids:
+        return [], last_uid
+    records = load_records(cache, mail, mailbox=mailbox, uids=uids)
+    loaded = {member["uid"] for record in records for member in thread_records(record)}
+    missing = [uid for uid in uids if uid not in loaded]
+    return records, (missing[0] - 1 if missing else uids[-1])
+
+
+# 每个账号的每个文件夹一个拉取函数，交给 run_pipeline 同时执行，每拉完一块就开始分类这一块
+# 同一个账号的文件夹共用这个账号的连接池，总耗时接近最慢的那个账号，而不是所有账号加起来
+def record_sources(cache=None, **search):
+    dedupe = make_dedupe()
+    return [functools.partial(iter_records, cache, mail_account=mail_account, dedupe=dedupe, mailbox=folder, **search)
+            for mail_account in mail_accounts for folder in mail_account.folders]
+
+# 去重用的键：同一封邮件出现在多个账号或文件夹里时 Message-ID 相同；没有 Message-ID 时不去重
+def record_key(record):
+    message_id = record["headers"].get("Message-ID")
+    return message_id or (record["account"], record["mailbox"], record["uid"])
+
+# 几个拉取函数（在各自的线程里）共用的去重函数，去掉 record_key 已经出现过的邮件；
+# 要在会话分组之前去重，否则同一封邮件会作为两个会话行的成员被重复计数、重复写入索引
+def make_dedupe():
+    lock = threading.Lock()
+    seen = set()
+
+    def dedupe(records):
+        unique = []
+        with lock:
+            for record in records:
+                key = record_key(record)
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(record)
+        metrics.inc("duplicates_skipped", len(records) - len(unique))
+        return unique
+    return dedupe
+
+# 分类结果写入 SQLite（本地缓存、会话状态、全文索引）都交给这一个线程按顺序执行，提交事务时不卡住事件循环里的 API 请求
+db_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+
+async def run_db_write(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(db_writer, functools.partial(func, *args))
+
+# 写入线程里保存一批分类结果和会话状态，各用一个事务，分类结果先写
+def save_results(cache, classifications, threads):
+    if classifications:
+        cache.save_classifications(classifications)
+    if threads:
+        cache.save_threads(threads)
+
+# 写入线程里更新全文索引
+def update_index(index, documents):
+    with metrics.timer("index_update"):
+        index.add_many(documents)
+
+# 对一批邮件分类（协程），返回和 records 对应的分类字段字典；新的分类结果用来训练本地模型并写入缓存
+# 传入 on_partial(record, info) 时，流式分类过程中的部分结果也会交给它；传入 index 时分类结果写入全文索引
+# 会话分组后每条记录代表一个会话：会话之前分类过时只把新邮件和上次的结果交给模型，新邮件都分类过时直接沿用
+async def classify_records(records, cache=None, on_partial=None, index=None):
+    infos = [record["classification"] for record in records]
+
+    # 同一个会话同时只能有一批在分类，按会话 id 排序加锁，不会互相等待
+    locks = [thread_index.lock_for(thread) for thread in sorted({record.get("thread") for record in records} - {None})]
+    for lock in locks:
+        await lock.acquire()
+    try:
+        states = {record["thread"]: thread_index.state(record["thread"], cache)
+                  for record in records if record.get("thread")}
+
+        # 缓存里没有分类结果时才调用 API
+        pending = []
+        items = []
+        for i, info in enumerate(infos):
+            if info is not None:
+                continue
+            record = records[i]
+            state = states.get(record.get("thread"))
+            previous = state["classification"] if state else None
+            new_records = [member for member in thread_records(record)
+                           if not state or member_key(member) not in state["members"]]
+            if previous and not new_records:
+                infos[i] = dict(previous)
+                metrics.inc("thread_reused")
+                continue
+            if previous:
+                metrics.inc("thread_incremental")
+            pending.append(i)
+            items.append((record["headers"], thread_content(new_records, previous)))
+
+        if pending:
+            classifications = await classify_emails_cached_async(
+                items, None if on_partial is None else lambda j, info: on_partial(records[pending[j]], info),
+            )
+            metrics.inc("classified_api", len(pending))
+            for i, classification in zip(pending, classifications):
+                record = records[i]
+                infos[i] = dict(zip(CLASSIFICATION_FIELDS, parse_classification(classification)))
+                if LOCAL_MODEL_ENABLED:
+                    local_model.learn(record["headers"], record["content"], infos[i])
+
+        saved = []
+        saved_threads = []
+        for i, record in enumerate(records):
+            # 会话里新分类的邮件都记下这个结果，下次加载时不用再分类
+            if infos[i] is not record["classification"]:
+                saved += [(member["account"], member["mailbox"], member["uidvalidity"], member["uid"], infos[i])
+                          for member in thread_records(record)
+                          if member["classification"] is None and member["uidvalidity"] is not None]
+            if record.get("thread"):
+                state = states[record["thread"]]
+                members = thread_records(record)
+                keys = (state["members"] if state else set()) | {member_key(member) for member in members}
+                last_date = max([member["headers"].get("日期", "") for member in members] +
+                                [state["last_date"] if state else ""])
+                # 只保存模型刚给出的结果，或者会话第一次出现时的结果；缓存里某封邮件以前的分类不能覆盖会话最新的状态
+                # 代表已经有分类时，同一行里更早的、还没分类过的邮件并入会话，沿用会话现有的分类；
+                # 之后它们单独出现时直接复用这个结果并写入缓存，不会再交给模型
+                classification = infos[i] if i in pending or state is None else state["classification"]
+                if i in pending or state is None or keys != state["members"]:
+                    # 内存里的状态马上更新，缓存和分类结果一起在写入线程里保存
+                    thread_index.save(record["thread"], classification, keys, last_date)
+                    saved_threads.append((record["thread"], classification, keys, last_date))
+                record["thread_size"] = len(keys)
+                record["thread_date"] = last_date
+        # 等写入完成再释放会话锁，同一个会话的下一批读到的一定是这次的状态
+        if cache and (saved or saved_threads):
+            await run_db_write(save_results, cache, saved, saved_threads)
+    finally:
+        for lock in locks:
+            lock.release()
+
+    if index is not None:
+        await run_db_write(update_index, index, [search_document(member, info) for record, info in zip(records, infos)
+                                                 for member in thread_records(record)
+                                                 if member["uidvalidity"] is not None])
+    return infos
+
+# 交给模型的会话内容：单独一封邮件就是它的正文；同一个会话的几封邮件从早到晚拼在一起；
+# 会话之前分类过时附上上次的结果，只发送新邮件，请模型给出整个会话最新的分类
+def thread_content(records, previous=None):
+    if len(records) == 1 and not previous:
+        return records[0]["content"]
+    parts = [f"[{record['headers'].get('日期', '')} {record['headers'].get('发件人', '')}]\n{record['content']}"
+             for record in records]
+    content = "\n\n".join(parts)
+    if len(records) > 1:
+        content = f"（同一个会话的 {len(records)} 封邮件，从早到晚）\n{content}"
+    if previous:
+        content = (f"（这是一个邮件会话的新回复，会话之前的分类结果如下，请结合新回复给出整个会话最新的分类，"
+                   f"总结概括整个会话）\n{format_classification(previous)}\n\n新回复：\n{content}")
+    # 几封邮件合在一起，预算放宽到两倍
+    return truncate_to_tokens(content, CONTENT_TOKEN_BUDGET * 2)
+
+# 一封邮件在全文索引里的内容：邮件头、正文和分类结果
+def search_document(record, info):
+    headers = record["headers"]
+    return {
+        "account": record["account"], "mailbox": record["mailbox"], "uidvalidity": record["uidvalidity"],
+        "uid": record["uid"], "date": headers.get("日期", ""), "subject": headers.get("主题", ""),
+        "from_addr": headers.get("发件人", ""), "body": record["content"],
+        "category": info["类型"], "priority": info["重要级"], "sender": info["发件人"], "recipient": info["收件人"],
+        "summary": info["总结"], "schedule": info["日程"],
+    }
+
+# 解析分类结果字符串为各个字段
+def parse_classification(classification):
+    lines = classification.splitlines()
+    info = {key: "" for key in CLASSIFICATION_FIELDS}
+
+    for line in lines:
+        for key in info.keys():
+            if line.startswith(f"{key}:"):
+                info[key] = line[len(key)+1:].strip()
+
+    return info["类型"], info["重要级"], info["发件人"], info["收件人"], info["总结"], info["日程"]
+
+# 导出运行指标，返回写入的路径
+def write_metrics(path=None):
+    path = path or data_path(METRICS_PATH)
+    memo_stats = classification_memo.stats()
+    lookups = memo_stats["hits"] + memo_stats["misses"]
+    metrics.set("memo_hits", memo_stats["hits"])
+    metrics.set("memo_misses", memo_stats["misses"])
+    metrics.set("memo_hit_rate", memo_stats["hits"] / lookups if lookups else 0.0)
+    metrics.set("memo_size", memo_stats["size"])
+    metrics.write(path)
+    return path
+
+# 用一个专用连接 IDLE 监听邮箱，一直使用同一个连接，记录见过的最大 UID，每次只拉取比它大的新邮件
+# handle_new_mail(mail, last_uid) 在监听连接上处理新邮件并返回新的最大 UID；stopped() 返回 True 时退出
+def watch_mailbox(handle_new_mail, stopped, mailbox='inbox'):
+    mail = None
+    last_uid = None
+    last_uidvalidity = None
+
+    while not stopped():
+        try:
+            if mail is None:
+                mail = connect_imap()
+                uidvalidity = select_mailbox(mail, mailbox)
+                # SELECT 响应里的 EXISTS 不是新邮件
+                mail.untagged_responses.pop('EXISTS', None)
+                if last_uid is None or uidvalidity != last_uidvalidity:
+                    # 第一次连接：从当前邮箱的最后一封开始算新邮件
+                    last_uid = (mail.selected_uidnext or 1) - 1
+                    last_uidvalidity = uidvalidity
+                else:
+                    # 断线重连：补上断开期间到达的邮件
+                    last_uid = handle_new_mail(mail, last_uid)
+
+            # 上次处理新邮件期间到达的邮件：imaplib 把服务器顺带推送的 EXISTS 记在 untagged_responses 里，
+            # IDLE 只会报告之后的变化，所以先补拉一次
+            if mail.untagged_responses.pop('EXISTS', None):
+                last_uid = handle_new_mail(mail, last_uid)
+                continue
+
+            # 等待服务器推送，29 分钟没有动静时重新 IDLE，防止被服务器断开
+            responses = idle_wait(mail, IDLE_TIMEOUT, stop=stopped)
+            if any(kind == 'EXISTS' for _, kind in parse_idle_events(responses)):
+                last_uid = handle_new_mail(mail, last_uid)
+
+        except Exception as e:
+            print("Error in watch_mailbox:", e)
+            if mail is not None:
+                try:
+                    mail.shutdown()
+                except Exception:
+                    pass
+            mail = None
+            time.sleep(IDLE_RECONNECT_DELAY)  # 出现错误后等待一段时间再重新连接
+
+    # 监听关闭后退出登录，不在服务器上留下连接
+    if mail is not None:
+        try:
+            mail.logout()
+        except Exception:
+            pass
+
+# 主线程检查后台结果的间隔（毫秒），每次把这段时间里完成的邮件一次性插入表格
+RESULT_POLL_MS = 50
+
+# 图形界面用到的模块在创建窗口时才导入，无界面模式 (headless.py) 不需要 tkinter
+tk = messagebox = VirtualTable = None
+
+def load_gui_modules():
+    global tk, messagebox, VirtualTable
+    import tkinter as tk
+    from tkinter import messagebox
+    from email_table import VirtualTable
+
+# 表格排序：重要级按紧急程度，日期按时间，发件人和收件人不区分大小写，其余列按文本
+PRIORITY_RANK = {"必须完成": 0, "回复必要": 1, "重要通知": 2, "一般通知": 3}
+
+def parse_row_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return datetime.min
+
+# 一行表格数据各列的排序键，插入表格时计算一次
+def row_sort_keys(values):
+    type_info, priority, date, sender, recipient, summary, schedule = values
+    return (
+        type_info,
+        (PRIORITY_RANK.get(priority, len(PRIORITY_RANK)), priority),
+        parse_row_date(date),
+        sender.casefold(),
+        recipient.casefold(),
+        summary,
+        schedule,
     )
-    return response.choices[0].message.content
+
+# 表格里一行对应的键：会话分组时一个会话一行，会话有新回复时原地更新；否则一封邮件一行
+def row_key(record):
+    if record.get("thread"):
+        return ("thread", record["thread"])
+    return (record["account"], record["mailbox"], record["uid"])
+
+# 一行表格数据；会话显示最新一封的日期，总结前面注明会话里的邮件数
+def row_values(record, info):
+    type_info, priority, sender, recipient, summary, schedule = (info[key] for key in CLASSIFICATION_FIELDS)
+    date = record.get("thread_date") or record["headers"]["日期"]
+    size = record.get("thread_size") or len(thread_records(record))
+    if size > 1:
+        summary = f"（会话 {size} 封）{summary}"
+    return (type_info, priority, date, sender, recipient, summary, schedule)
 
 # 主函数
 class EmailApp:
     def __init__(self, root):
+        load_gui_modules()
         self.root = root
         self.root.title("邮件助手")
 
@@ -210,9 +1085,40 @@ class EmailApp:
         load_by_date_button = tk.Button(top_frame, text="加载邮件", command=self.load_emails_by_date)
         load_by_date_button.pack(side=tk.LEFT, padx=5)
 
+        # 导出运行指标
+        export_metrics_button = tk.Button(top_frame, text="导出统计", command=self.export_metrics)
+        export_metrics_button.pack(side=tk.LEFT, padx=5)
+
+        # 筛选条件，加载时交给服务器搜索，按数量和按日期加载都适用
+        filter_frame = tk.Frame(root)
+        filter_frame.pack(side=tk.TOP, fill=tk.X)
+
+        tk.Label(filter_frame, text="发件人:").pack(side=tk.LEFT, padx=5)
+        self.sender_entry = tk.Entry(filter_frame, width=20)
+        self.sender_entry.pack(side=tk.LEFT)
+
+        tk.Label(filter_frame, text="主题关键词:").pack(side=tk.LEFT, padx=5)
+        self.subject_entry = tk.Entry(filter_frame, width=20)
+        self.subject_entry.pack(side=tk.LEFT)
+
+        self.unseen_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(filter_frame, text="只看未读", variable=self.unseen_var).pack(side=tk.LEFT, padx=5)
+        self.flagged_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(filter_frame, text="只看星标", variable=self.flagged_var).pack(side=tk.LEFT, padx=5)
+
+        # 在本地全文索引里搜索处理过的邮件，不连接邮箱也不调用 API
+        tk.Label(filter_frame, text="本地搜索:").pack(side=tk.LEFT, padx=5)
+        self.search_entry = tk.Entry(filter_frame, width=30)
+        self.search_entry.pack(side=tk.LEFT)
+        self.search_entry.bind("<Return>", lambda event: self.search_local())
+        search_button = tk.Button(filter_frame, text="搜索", command=self.search_local)
+        search_button.pack(side=tk.LEFT, padx=5)
+
         # 创建TreeView表格
         columns = ("类型", "重要级", "日期", "发件人", "收件人", "总结", "日程")
-        self.tree = ttk.Treeview(root, columns=columns, show="headings")
+        self.table = VirtualTable(root, columns, row_tags={'red': '#FFC0C0', 'blue': '#ADD8E6'},  # 淡红色、淡蓝色
+                                  sort_keys=row_sort_keys)
+        self.tree = self.table.tree
 
         # 设置列标题及其宽度，并绑定排序事件
         for col in columns:
@@ -228,8 +1134,6 @@ class EmailApp:
             elif col == "日程":
                 self.tree.column(col, width=200, anchor="center")
 
-        self.tree.pack(fill=tk.BOTH, expand=True)
-
         # 记录排序的状态
         self.sorting_order = {col: False for col in columns}
 
@@ -247,6 +1151,34 @@ class EmailApp:
         # 启动监听线程的标识
         self.idle_thread = None
 
+        # 本地缓存，已经处理过的邮件不用重新拉取和分类
+        self.cache = MailCache(data_path(CACHE_PATH)) if CACHE_ENABLED else None
+        self.index = SearchIndex(data_path(SEARCH_PATH)) if SEARCH_ENABLED else None
+
+        # 拉取和分类在后台事件循环里进行，结果经队列交给主线程；每次重新加载时 generation 加一，旧结果随之作废
+        self.background = BackgroundLoop()
+        self.results = queue.Queue()
+        self.generation = 0
+        self.pipelines = []
+        self.total = 0
+        # 已经显示的邮件（会话）在表格数据里的行号 {row_key(记录): 行号}
+        self.row_index = {}
+        # 进度显示用：正在运行的流水线数、本次加载的开始时间和开始时的 token 用量
+        self.running = 0
+        self.load_started = time.perf_counter()
+        self.tokens_before = 0
+        self.load_error = None
+        self.root.after(RESULT_POLL_MS, self.drain_results)
+        if METRICS_EXPORT_INTERVAL > 0:
+            self.root.after(METRICS_EXPORT_INTERVAL * 1000, self.export_metrics_periodically)
+
+        # 窗口出现后在后台导入 openai，第一次分类时不用再等
+        threading.Thread(target=load_openai, daemon=True).start()
+
+        # 用缓存里的历史分类结果训练本地模型，不阻塞窗口
+        if LOCAL_MODEL_ENABLED and self.cache:
+            threading.Thread(target=lambda: local_model.train(self.cache.labelled_messages()), daemon=True).start()
+
     # 启用或禁用监听的函数
     def toggle_listen(self):
         if self.enable_listen_var.get():
@@ -267,60 +1199,26 @@ class EmailApp:
         if self.idle_thread and self.idle_thread.is_alive():
             self.idle_thread = None  # 设置为 None，让 idle_mailbox 自然结束
 
-                # 执行 IDLE 监听的函数
+    # 执行 IDLE 监听的函数，关闭监听时 idle_thread 被置空，循环随之结束
     def idle_mailbox(self):
-        while self.idle_thread:
-            try:
-                # 连接到 IMAP 服务器并执行 IDLE
-                mail = connect_imap()
-                mail.select('inbox')
-                
-                # IDLE 命令等待新邮件
-                mail.send(b'0001 IDLE\r\n')
-                response = mail.readline()
-                
-                # 当有新的邮件时，服务器会通知
-                if b'EXISTS' in response:
-                    # 退出 IDLE 模式
-                    mail.send(b'DONE\r\n')
-                    mail.readline()
-                    
-                    # 处理新邮件
-                    self.handle_new_mail()
-                    
-                # 等待 10 秒后重新进入 IDLE，保持连接
-                time.sleep(10)
+        watch_mailbox(self.handle_new_mail, stopped=lambda: threading.current_thread() is not self.idle_thread)
 
-            except Exception as e:
-                print("Error in idle_mailbox:", e)
-                time.sleep(60)  # 出现错误后等待 60 秒再重新连接
+    # 处理新邮件的函数：在监听连接上一次拉取所有 UID 大于 last_uid 的邮件，返回新的 last_uid
+    def handle_new_mail(self, mail, last_uid):
+        records, last_uid = load_new_records(self.cache, mail, last_uid)
+        if not records:
+            return last_uid
 
-    # 处理新邮件的函数
-    def handle_new_mail(self):
-        print("新邮件到达，正在处理...")
-        
-        # 加载最新邮件
-        mail = connect_imap()
-        emails = fetch_emails(mail, limit=1)  # 只加载最新的一封邮件
+        print(f"{len(records)} 封新邮件到达，正在处理...")
 
-        # 将新邮件插入表格
-        for i, msg in enumerate(emails):
-            threading.Thread(target=self.process_email, args=(msg, i + 1, len(emails))).start()
+        # 将新邮件插入表格，不影响正在进行的加载；这里是监听线程，Tk 只能在主线程里调用
+        self.root.after(0, lambda: self.start_pipeline(lambda: records))
+        return last_uid
 
 
     def sort_column(self, col, reverse):
-        # 获取列中的所有项
-        data = [(self.tree.set(item, col), item) for item in self.tree.get_children('')]
-
-        # 判断数据类型并排序
-        try:
-            data.sort(key=lambda t: float(t[0]), reverse=reverse)  # 数字排序
-        except ValueError:
-            data.sort(key=lambda t: t[0], reverse=reverse)  # 字符串排序
-
-        # 清空当前表格内容
-        for index, (val, item) in enumerate(data):
-            self.tree.move(item, '', index)
+        # 按插入时算好的排序键对全部行排序，表格里只有能看到的几行
+        self.table.sort(col, reverse=reverse)
 
         # 切换排序顺序
         self.sorting_order[col] = not reverse
@@ -330,8 +1228,6 @@ class EmailApp:
                           command=lambda: self.sort_column(col, not reverse))
 
     def load_emails(self):
-        mail = connect_imap()
-
         # 按数量拉取
         try:
             start = int(self.start_entry.get())
@@ -340,21 +1236,16 @@ class EmailApp:
             messagebox.showerror("错误", "请输入有效的数字")
             return
 
-        emails = fetch_emails(mail, limit=limit, start=start)
-
-        # 重置处理计数器并清空表格
-        self.processed_count = 0
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        if start < 0 or limit < 0:
+            messagebox.showerror("错误", "请输入有效的数字")
+            return
 
-        # 使用线程处理每封邮件
-        for i, msg in enumerate(emails):
-            threading.Thread(target=self.process_email, args=(msg, i + 1, len(emails))).start()
+        # 连接、拉取和分类都在后台进行，窗口不会卡住；起始邮件编号从最新的一封算起，0 表示最新
+        self.start_pipeline(self.record_sources(limit=limit, start=start, search_filter=self.search_filter()),
+                            replace=True)
 
     # 按日期拉取邮件的函数
     def load_emails_by_date(self):
-        mail = connect_imap()
-
         start_date = self.start_date_entry.get()
         end_date = self.end_date_entry.get()
 
@@ -367,61 +1258,200 @@ class EmailApp:
             return
 
         # 获取符合日期范围的邮件
-        emails = fetch_emails(mail, start_date=start_date, end_date=end_date)
+        self.start_pipeline(self.record_sources(start_date=start_date, end_date=end_date,
+                                                search_filter=self.search_filter()), replace=True)
 
-        # 清空表格并重置计数器
-        self.processed_count = 0
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+    # 筛选条件输入框里的内容
+    def search_filter(self):
+        return SearchFilter(self.sender_entry.get(), self.subject_entry.get(),
+                            unseen=self.unseen_var.get(), flagged=self.flagged_var.get())
 
-        # 使用线程处理每封邮件
-        for i, msg in enumerate(emails):
-            threading.Thread(target=self.process_email, args=(msg, i + 1, len(emails))).start()
+    # 所有账号、文件夹的拉取函数
+    def record_sources(self, **search):
+        return record_sources(self.cache, **search)
 
-    def process_email(self, msg, current, total):
-        headers = extract_email_headers(msg)
-        content = extract_email_content(msg)
-        classification = classify_email(headers, content)
+    # 在后台事件循环里启动一条拉取 → 分类流水线；load_records 可以是多个拉取函数，结果合并去重后显示在同一个表格里
+    # replace=True 时取消上一次加载并清空表格
+    def start_pipeline(self, load_records, replace=False):
+        if replace:
+            self.reset_table()
 
-        # 解析分类结果并插入到TreeView
-        type_info, priority, sender, recipient, summary, schedule = self.parse_classification(classification)
+        self.running += 1
 
-        # 在主线程中更新TreeView和进度标签
-        self.root.after(0, self.update_ui, type_info, priority, headers["日期"], sender, recipient, summary, schedule, current, total)
+        generation = self.generation
 
-    def update_ui(self, type_info, priority, date, sender, recipient, summary, schedule, current, total):
-        # 插入数据
-        row_id = self.tree.insert("", 0, values=(type_info, priority, date, sender, recipient, summary, schedule))
+        def emit(item):
+            self.results.put((generation,) + item)
 
-        # 根据重要性设置行颜色
-        if priority == "必须完成" or  priority == "回复必要":
-            self.tree.item(row_id, tags=('red',))
-        elif priority == "重要通知":
-            self.tree.item(row_id, tags=('blue',))
+        self.pipelines = [future for future in self.pipelines if not future.done()]
+        self.pipelines.append(
+            self.background.submit(run_pipeline(load_records, self.classify_records, emit, CLASSIFY_WORKERS,
+                                                make_classification_batches, metrics, partial=STREAM,
+                                                key=record_key, buffer=PIPELINE_BUFFER))
+        )
 
-        # 添加样式
-        # 在 TreeView 中创建标签并设置颜色
-        self.tree.tag_configure('red', background='#FFC0C0')  # 淡红色
-        self.tree.tag_configure('blue', background='#ADD8E6')  # 淡蓝色
+    # 取消正在进行的加载，清空表格并重置计数器
+    def reset_table(self):
+        self.generation += 1
+        for future in self.pipelines:
+            future.cancel()
+        self.pipelines = []
 
-        # 更新进度标签 FIXME: 这里计数有问题，修了之后可以用ifelse改成加载完成。
-        self.processed_count += 1
-        self.progress_label.config(text=f"加载共计{total}") 
+        self.processed_count = 0
+        self.total = 0
+        self.running = 0
+        self.load_started = time.perf_counter()
+        self.tokens_before = metrics.counter("prompt_tokens") + metrics.counter("completion_tokens")
+        self.load_error = None
+        self.table.clear()
+        self.row_index = {}
+
+    # 在后台事件循环里对一批邮件分类，返回和 records 对应的分类字段字典
+    async def classify_records(self, records, on_partial=None):
+        return await classify_records(records, self.cache, on_partial, self.index)
+
+    # 本地搜索：结果替换表格里的内容，按相关度排列
+    def search_local(self):
+        if self.index is None:
+            messagebox.showerror("错误", "本地搜索没有开启（[SEARCH] ENABLED）")
+            return
+        text = self.search_entry.get().strip()
+        if not text:
+            return
+
+        self.reset_table()
+        started = time.perf_counter()
+        with metrics.timer("index_search"):
+            documents = self.index.search(text, SEARCH_LIMIT)
+        rows = {(document["account"], document["mailbox"], document["uid"]):
+                (document["category"], document["priority"], document["date"], document["sender"],
+                 document["recipient"], document["summary"], document["schedule"]) for document in documents}
+        self.processed_count = self.total = len(rows)
+        self.update_ui(rows, self.total)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.progress_label.config(text=f"本地搜索到 {len(rows)} 封，用时 {elapsed:.0f} 毫秒"
+                                        + ("（只显示前面的结果）" if len(documents) >= SEARCH_LIMIT else ""))
+
+    # 主线程定时取出后台流水线的结果，攒成一批后一次性更新表格
+    def drain_results(self):
+        metrics.set("ui_queue_depth", self.results.qsize())
+        # {row_key(记录): 行的值}，同一封邮件（会话）的部分结果和最终结果只保留最新的一份
+        rows = {}
+        changed = False
+        try:
+            while True:
+                generation, kind, *payload = self.results.get_nowait()
+
+                # 表格已经被新的加载替换，旧结果不再显示
+                if generation != self.generation:
+                    continue
+
+                changed = True
+                if kind == "total":
+                    self.total += payload[0]
+                elif kind == "row" or kind == "partial":
+                    record, info = payload
+                    rows[row_key(record)] = row_values(record, info)
+                    # 流式分类的部分结果先显示出来，等最终结果到了才算处理完
+                    if kind == "row":
+                        self.processed_count += 1
+                elif kind == "error":
+                    record, error = payload
+                    # 分类失败的邮件也算处理过了，否则进度永远到不了总数
+                    if record is not None:
+                        self.processed_count += 1
+                    else:
+                        self.load_error = error
+                elif kind == "done":
+                    self.running -= 1
+        except queue.Empty:
+            pass
+
+        if rows:
+            with metrics.timer("ui_insert"):
+                self.update_ui(rows, self.total)
+        elif changed:
+            self.update_progress(self.total)
+        self.root.after(RESULT_POLL_MS, self.drain_results)
+
+    def update_ui(self, rows, total):
+        # 根据重要性设置行颜色；已经显示过的邮件（流式分类的部分结果）原地更新，其余整批插入
+        new_keys = []
+        new_rows = []
+        updates = {}
+        for row_key, values in rows.items():
+            priority = values[1]
+            if priority == "必须完成" or priority == "回复必要":
+                tagged = (values, 'red')
+            elif priority == "重要通知":
+                tagged = (values, 'blue')
+            else:
+                tagged = (values, None)
+            if row_key in self.row_index:
+                updates[self.row_index[row_key]] = tagged
+            else:
+                new_keys.append(row_key)
+                new_rows.append(tagged)
+        self.table.update_rows(updates)
+        self.row_index.update(zip(new_keys, self.table.insert_rows(new_rows)))
+        self.update_progress(total)
+
+    # 更新进度标签：已完成数量、按目前速度估算的剩余时间和消耗的 token
+    def update_progress(self, total):
+        # 所有账号、文件夹都没加载出来时显示失败原因，只有部分失败时在进度后面注明
+        if self.load_error is not None and not self.total:
+            self.progress_label.config(text=f"加载失败：{self.load_error}")
+            return
+        failed = f"（部分邮箱加载失败：{self.load_error}）" if self.load_error is not None else ""
+        done = min(self.processed_count, total)
+        elapsed = time.perf_counter() - self.load_started
+        tokens = metrics.counter("prompt_tokens") + metrics.counter("completion_tokens") - self.tokens_before
+        memo_hits = classification_memo.stats()["hits"]
+        if self.running > 0 or done < total:
+            eta = f"{elapsed / done * (total - done):.0f}" if done else "--"
+            self.progress_label.config(text=f"已完成 {done}/{total}，预计还需 {eta} 秒，"
+                                            f"消耗 {tokens} tokens，重复邮件复用{memo_hits}次{failed}")
+        else:
+            self.progress_label.config(text=f"加载完成，共 {total} 封，用时 {elapsed:.1f} 秒，"
+                                            f"消耗 {tokens} tokens，重复邮件复用{memo_hits}次{failed}")
 
     def parse_classification(self, classification):
-        # 解析分类结果字符串为各个字段
-        lines = classification.splitlines()
-        info = {"类型": "", "重要级": "", "发件人": "", "收件人": "", "总结": "", "日程": ""}
+        return parse_classification(classification)
 
-        for line in lines:
-            for key in info.keys():
-                if line.startswith(f"{key}:"):
-                    info[key] = line[len(key)+1:].strip()
+    # 把运行指标写入 [METRICS] PATH
+    def export_metrics(self):
+        try:
+            path = write_metrics()
+        except OSError as e:
+            messagebox.showerror("错误", f"导出统计失败：{e}")
+            return
+        messagebox.showinfo("导出统计", f"已导出到 {path}")
+
+    # 每隔 EXPORT_INTERVAL 秒自动导出一次，出错只打印不弹窗
+    def export_metrics_periodically(self):
+        try:
+            write_metrics()
+        except OSError as e:
+            print(f"导出统计失败：{e}")
+        self.root.after(METRICS_EXPORT_INTERVAL * 1000, self.export_metrics_periodically)
+
+startup_timer.mark("config and setup")
 
-        return info["类型"], info["重要级"], info["发件人"], info["收件人"], info["总结"], info["日程"]
+# 窗口第一次空闲时说明已经显示出来了
+def on_window_shown():
+    startup_timer.mark("window shown")
+    startup_timer.report()
 
 # 主程序
 if __name__ == "__main__":
+    load_gui_modules()
+    startup_timer.mark("import tkinter")
     root = tk.Tk()
     app = EmailApp(root)
+    startup_timer.mark("build window")
+    root.after_idle(on_window_shown)
     root.mainloop()
+
+    # 窗口关闭后退出登录池里的连接
+    for mail_account in mail_accounts:
+        mail_account.close()
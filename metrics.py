@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 运行指标：各阶段耗时、计数（请求数、重试次数、token 用量等）和队列长度
+# 可以导出成 JSON，或者 Prometheus 的文本格式（node_exporter 的 textfile collector 可以直接读取）
+
+# 每个阶段保留最近这么多个耗时样本用来计算分位数
+RECENT_SAMPLES = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _quantile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class StageTimer:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def snapshot(self):
+        recent = sorted(self.recent)
+        result = {"count": self.count, "total_seconds": self.total, "max_seconds": self.max}
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}_seconds"] = _quantile(recent, q)
+        return result
+
+
+class Metrics:
+    def __init__(self, prefix="mail_assistant"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.stages = {}
+
+    def inc(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            timer = self.stages.get(stage)
+            if timer is None:
+                timer = self.stages[stage] = StageTimer()
+            timer.add(seconds)
+
+    # with metrics.timer("imap_fetch"): ...  记录代码块的耗时
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def counter(self, name):
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "timestamp": time.time(),
+                "uptime_seconds": time.time() - self.started_at,
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "stages": {stage: timer.snapshot() for stage, timer in self.stages.items()},
+            }
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = f"{self.prefix}_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, value in sorted(snapshot["gauges"].items()):
+            metric = f"{self.prefix}_{name}"
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        if snapshot["stages"]:
+            metric = f"{self.prefix}_stage_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for stage, stats in sorted(snapshot["stages"].items()):
+                for q in QUANTILES:
+                    lines.append(f'{metric}{{stage="{stage}",quantile="{q}"}} {stats[f"p{int(q * 100)}_seconds"]:.6f}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {stats["total_seconds"]:.6f}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+    # 写入文件，扩展名是 .json 时写 JSON，否则写 Prometheus 文本；先写临时文件再替换，读取方不会读到一半的内容
+    def write(self, path):
+        if path.lower().endswith(".json"):
+            text = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        else:
+            text = self.to_prometheus()
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp_path, path)
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 拉取 → 分类的 asyncio 流水线，运行在后台线程的事件循环里，Tk 主线程只负责提交任务和显示结果
+
+
+# 在独立的守护线程里运行一个事件循环
+class BackgroundLoop:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    # 从任意线程提交协程，返回 concurrent.futures.Future，cancel() 会取消对应的任务
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+# load_records 是阻塞函数（连接、拉取 IMAP），放到单独的线程里执行；也可以是多个这样的函数（例如每个账号、文件夹一个），
+# 它们同时执行，哪个先拉取完就先分类哪个，其中一个出错不影响其他的；key(记录) 相同的记录只处理第一次出现的
+# load_records 可以返回记录列表，也可以返回一块一块交出记录列表的迭代器（生成器），这时拉一块分类一块：
+# 等待分类的批最多 buffer 个，排满时暂停拉取，内存占用取决于 buffer 而不是邮件总数
+# classify(records) 是协程，对一批记录分类并按顺序返回分类结果；make_batches(records) 决定怎么分批，默认一封一批
+# 结果通过 emit 以 ("total", 数量) / ("row", 记录, 分类) / ("error", 记录, 异常) / ("done", 数量) 的形式交出去，
+# 每个拉取函数完成时各发一次 "total"，拉取失败时发 ("error", None, 异常)；
+# emit 会在事件循环线程里调用，需要是线程安全的（例如 queue.Queue.put）
+# 传入 metrics 时记录拉取和每批分类的耗时，以及还在排队的批数
+# partial=True 时 classify 还会收到第二个参数 on_partial(记录, 分类)，分类完成之前的部分结果以 ("partial", 记录, 分类) 交出去
+async def run_pipeline(load_records, classify, emit, concurrency=8, make_batches=None, metrics=None,
+                       partial=False, key=None, buffer=64):
+    sources = load_records if isinstance(load_records, (list, tuple)) else [load_records]
+    # 每个拉取函数一个线程，某个账号很慢时不会占住其他账号的线程
+    executor = ThreadPoolExecutor(max_workers=len(sources) or 1, thread_name_prefix="pipeline-load")
+    queue = asyncio.Queue(maxsize=max(1, buffer))
+    seen = set()
+    total = 0
+
+    def on_partial(record, info):
+        emit(("partial", record, info))
+
+    # 在拉取线程里执行 func，返回结果；协程被取消时 on_cancel 会在 func 执行完之后（同一个线程里）调用
+    async def in_thread(func, on_cancel=None):
+        future = executor.submit(func)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if on_cancel:
+                future.add_done_callback(lambda _: on_cancel())
+            raise
+
+    async def load(source):
+        chunks = None
+        try:
+            started = time.perf_counter()
+            result = await in_thread(source)
+            chunks = iter([result]) if isinstance(result, list) else result
+            while True:
+                # 生成器正在执行时不能关闭，取消时等这一块拉完再关闭，释放它占用的连接
+                records = await in_thread(lambda: next(chunks, None), getattr(chunks, "close", None))
+                if records is None:
+                    break
+                await add(records)
+            if metrics:
+                metrics.observe("load_records", time.perf_counter() - started)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error loading emails: {e}")
+            emit(("error", None, e))
+        finally:
+            close = getattr(chunks, "close", None)
+            if close:
+                try:
+                    close()
+                except ValueError:
+                    # 生成器还在拉取线程里执行，上面已经安排了执行完之后关闭
+                    pass
+
+    async def add(records):
+        nonlocal total
+        if key:
+            unique = []
+            for record in records:
+                record_key = key(record)
+                if record_key not in seen:
+                    seen.add(record_key)
+                    unique.append(record)
+            if metrics:
+                metrics.inc("duplicates_skipped", len(records) - len(unique))
+            records = unique
+
+        total += len(records)
+        emit(("total", len(records)))
+        for batch in (make_batches(records) if make_batches else [[record] for record in records]):
+            await queue.put(batch)
+            if metrics:
+                metrics.set("pipeline_pending_batches", queue.qsize())
+
+    async def consume():
+        while True:
+            batch = await queue.get()
+            # 所有拉取都完成后每个消费者会收到一个 None
+            if batch is None:
+                return
+            if metrics:
+                metrics.set("pipeline_pending_batches", queue.qsize())
+            try:
+                started = time.perf_counter()
+                infos = await (classify(batch, on_partial) if partial else classify(batch))
+                if metrics:
+                    metrics.observe("classify_batch", time.perf_counter() - started)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                for record in batch:
+                    print(f"Error processing email UID {record['uid']}: {e}")
+                    emit(("error", record, e))
+                continue
+            for record, info in zip(batch, infos):
+                emit(("row", record, info))
+
+    # 并发数由消费者个数决定，每个在途请求只是一个协程，不再占用一个线程；拉取还没完成时消费者就开始分类
+    consumers = [asyncio.ensure_future(consume()) for _ in range(max(1, concurrency))]
+    try:
+        await asyncio.gather(*(load(source) for source in sources))
+        for _ in consumers:
+            await queue.put(None)
+        await asyncio.gather(*consumers)
+    finally:
+        for consumer in consumers:
+            consumer.cancel()
+        executor.shutdown(wait=False)
+    emit(("done", total))
@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+
+# 令牌桶限流：同时限制每分钟请求数和每分钟 token 数，0 表示不限制
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.lock = threading.Lock()
+        # 桶一开始是满的，允许一分钟额度内的突发
+        self.request_tokens = float(requests_per_minute)
+        self.token_tokens = float(tokens_per_minute)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if self.requests_per_minute:
+            self.request_tokens = min(self.requests_per_minute,
+                                      self.request_tokens + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self.token_tokens = min(self.tokens_per_minute,
+                                    self.token_tokens + elapsed * self.tokens_per_minute / 60)
+
+    # 计算还需要等待多久才能放行，返回 0 表示已经扣除额度
+    def _try_acquire(self, tokens):
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        # 单个请求超过整桶容量时按整桶算，否则永远等不到
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+
+        wait = 0.0
+        if self.requests_per_minute and self.request_tokens < 1:
+            wait = max(wait, (1 - self.request_tokens) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self.token_tokens < tokens:
+            wait = max(wait, (tokens - self.token_tokens) * 60 / self.tokens_per_minute)
+        if wait:
+            return wait
+
+        if self.requests_per_minute:
+            self.request_tokens -= 1
+        if self.tokens_per_minute:
+            self.token_tokens -= tokens
+        return 0.0
+
+    # 等到拿到一个请求和 tokens 个 token 的额度，等待时不阻塞事件循环
+    async def acquire_async(self, tokens=1):
+        while True:
+            with self.lock:
+                wait = self._try_acquire(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    # 服务器返回 429 时，所有请求一起暂停一段时间
+    def pause(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
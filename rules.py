@@ -0,0 +1,124 @@
+import fnmatch
+import re
+from email.utils import getaddresses
+
+# 规则快速分类：在调用模型之前按发件人、邮件列表头和主题关键词直接给出类型和重要级
+# 规则写在 .config 里，每条规则一个 [RULE 名称] 小节，同一条规则里的各项条件需要同时满足：
+#
+#   [RULE 讲座宣传]
+#   SENDERS = *@news.example.edu.cn, activity@example.edu.cn
+#   SUBJECT_KEYWORDS = 讲座, 论坛, 沙龙
+#   BULK = true
+#   TYPE = 活动宣传
+#   PRIORITY = 一般通知
+#
+# [RULES] 小节的 IMPORTANT_KEYWORDS 出现在主题或正文里时不走规则，一定交给模型判断
+
+DEFAULT_IMPORTANT_KEYWORDS = "调课, 停课, 放假, 施工, 极端天气, 台风, 暴雨, 停水, 停电, 考试, 截止, 必须, 务必"
+BULK_PRECEDENCE = {"bulk", "list", "junk"}
+
+
+# 把关键词编译成一个正则，匹配时只需要扫描一遍文本
+def compile_keywords(keywords):
+    keywords = sorted({keyword for keyword in keywords if keyword}, key=len, reverse=True)
+    if not keywords:
+        return None
+    return re.compile("|".join(re.escape(keyword) for keyword in keywords), re.IGNORECASE)
+
+# 把发件人通配符（*@example.edu.cn）编译成一个正则
+def compile_patterns(patterns):
+    patterns = [pattern for pattern in patterns if pattern]
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern.lower()) for pattern in patterns))
+
+def split_list(value):
+    return [item.strip() for item in re.split(r'[,，\n]', value or "") if item.strip()]
+
+# 判断是不是群发邮件：有 List-Id / List-Unsubscribe 头，或者 Precedence 是 bulk/list/junk
+def is_bulk(headers):
+    if headers.get("List-Id") or headers.get("List-Unsubscribe"):
+        return True
+    return (headers.get("Precedence") or "").strip().lower() in BULK_PRECEDENCE
+
+
+class Rule:
+    def __init__(self, name, senders=None, subject_keywords=None, bulk=None, type_info="", priority=""):
+        self.name = name
+        self.senders = compile_patterns(senders or [])
+        self.subject_keywords = compile_keywords(subject_keywords or [])
+        self.bulk = bulk
+        self.type_info = type_info
+        self.priority = priority
+
+    def matches(self, sender_addresses, subject, bulk):
+        if self.senders and not any(self.senders.match(address) for address in sender_addresses):
+            return False
+        if self.subject_keywords and not self.subject_keywords.search(subject):
+            return False
+        if self.bulk is not None and self.bulk != bulk:
+            return False
+        return True
+
+
+class RuleEngine:
+    def __init__(self, rules=None, important_keywords=None):
+        self.rules = rules or []
+        self.important_keywords = compile_keywords(important_keywords or [])
+
+    # 从 .config 读取规则，规则在第一次构造时编译好
+    @classmethod
+    def from_config(cls, config):
+        if not config.getboolean('RULES', 'ENABLED', fallback=True):
+            return cls()
+
+        rules = []
+        for section in config.sections():
+            if not section.upper().startswith("RULE "):
+                continue
+            options = config[section]
+            bulk = options.getboolean('BULK') if 'BULK' in options else None
+            rules.append(Rule(
+                section[len("RULE "):].strip(),
+                senders=split_list(options.get('SENDERS')),
+                subject_keywords=split_list(options.get('SUBJECT_KEYWORDS')),
+                bulk=bulk,
+                type_info=options.get('TYPE', ''),
+                priority=options.get('PRIORITY', '一般通知'),
+            ))
+
+        important_keywords = split_list(config.get('RULES', 'IMPORTANT_KEYWORDS', fallback=DEFAULT_IMPORTANT_KEYWORDS))
+        return cls(rules, important_keywords)
+
+    # 返回第一条命中的规则给出的分类字段字典，没有命中或者可能是重要邮件时返回 None
+    def match(self, headers, content):
+        if not self.rules:
+            return None
+
+        subject = headers.get("主题", "")
+        if self.important_keywords and (self.important_keywords.search(subject)
+                                        or self.important_keywords.search(content or "")):
+            return None
+
+        sender_addresses = [address.lower() for _, address in getaddresses([headers.get("发件人", "")]) if address]
+        bulk = is_bulk(headers)
+        for rule in self.rules:
+            if rule.matches(sender_addresses, subject, bulk):
+                return {
+                    "类型": rule.type_info,
+                    "重要级": rule.priority,
+                    "发件人": headers.get("发件人", ""),
+                    "收件人": headers.get("收件人", ""),
+                    "总结": subject,
+                    "日程": "",
+                }
+        return None
+
+    # 给命中规则的记录直接填上分类结果，返回原列表
+    def apply(self, records):
+        for record in records:
+            if record["classification"] is None:
+                info = self.match(record["headers"], record["content"])
+                if info is not None:
+                    record["classification"] = info
+        return records
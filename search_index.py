@@ -0,0 +1,196 @@
+import re
+import sqlite3
+import threading
+
+# 本地全文索引：主题、发件人、正文和模型生成的总结/日程放进 SQLite FTS5，不联网在本地查找旧邮件
+#
+# FTS5 自带的 unicode61 分词器把连续的汉字当成一个词，搜不到词中间的部分，所以写入前先切分：
+# 连续的汉字（假名、谚文同样处理）切成相邻两个字一组，再加上最后一个字，例如 “调课通知” → “调课 课通 通知 知”。
+# 查询按同样的方式切分后作为短语匹配，任意长度的中文关键词都能找到；英文、数字、邮箱地址仍由 unicode61 分词
+#
+# FTS 表不保存原文 (content='')，显示用的字段存在 documents 表里；UIDVALIDITY 变了时对应邮箱的索引整体清掉
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mailboxes (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    PRIMARY KEY (account, mailbox)
+);
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    from_addr TEXT NOT NULL,
+    body TEXT NOT NULL,
+    category TEXT NOT NULL,
+    priority TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    schedule TEXT NOT NULL,
+    UNIQUE (account, mailbox, uidvalidity, uid)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    subject, sender, body, summary, schedule, content='', tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+# 一条索引记录的字段，add_many 传入的字典需要包含这些键
+DOCUMENT_FIELDS = (
+    "account", "mailbox", "uidvalidity", "uid", "date", "subject", "from_addr", "body",
+    "category", "priority", "sender", "recipient", "summary", "schedule",
+)
+_STORED_FIELDS = DOCUMENT_FIELDS[4:]
+# 搜索结果的排序权重，依次对应 FTS 表的 subject, sender, body, summary, schedule
+_COLUMN_WEIGHTS = (10.0, 5.0, 1.0, 4.0, 4.0)
+# 只对最近写入的这么多个匹配计算相关度：常见的词几乎每封邮件都有，全部打分要上百毫秒
+RANK_CANDIDATES = 2000
+
+_CJK = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]+')
+_WORD = re.compile(r'[^\W_]')
+
+
+# 一段连续的汉字切成两字一组；complete=True 时再加上最后一个字，这样单个字的前缀查询也能匹配到词尾
+def _split_run(run, complete=True):
+    if len(run) == 1:
+        return run
+    tokens = [run[i:i + 2] for i in range(len(run) - 1)]
+    if complete:
+        tokens.append(run[-1])
+    return " ".join(tokens)
+
+# 写入索引前的切分
+def segment(text):
+    return _CJK.sub(lambda match: f" {_split_run(match.group())} ", text or "")
+
+# 把搜索框里的内容转成 FTS5 查询：空格分隔的每个词都要出现（AND），每个词按短语匹配，最后一个字或单词按前缀匹配
+# 词末尾的汉字在邮件里后面可能还有字，只用两字组，不加最后一个字；没有可搜索的内容时返回空字符串
+def build_query(text):
+    phrases = []
+    for term in (text or "").split():
+        runs = list(_CJK.finditer(term))
+        open_end = runs[-1].start() if runs and not _WORD.search(term, runs[-1].end()) else None
+        segmented = _CJK.sub(lambda match: f" {_split_run(match.group(), match.start() != open_end)} ", term)
+        if _WORD.search(segmented):
+            phrases.append('"' + segmented.replace('"', '""') + '"*')
+    return " AND ".join(phrases)
+
+def _fts_values(document):
+    return (
+        segment(document["subject"]),
+        segment(f"{document['from_addr']} {document['sender']}"),
+        segment(document["body"]),
+        segment(document["summary"]),
+        segment(document["schedule"]),
+    )
+
+
+class SearchIndex:
+    def __init__(self, path):
+        self.path = path
+        # 分类完成后在事件循环线程里写入，界面在主线程里查询，共用一个连接加锁
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def _delete_locked(self, rows):
+        # content='' 的 FTS 表删除时要提供写入时的内容，由 documents 表里保存的字段重新切分得到
+        for row in rows:
+            document = dict(zip(("id",) + _STORED_FIELDS, row))
+            self.conn.execute(
+                "INSERT INTO documents_fts (documents_fts, rowid, subject, sender, body, summary, schedule) "
+                "VALUES ('delete', ?, ?, ?, ?, ?, ?)",
+                (document["id"], *_fts_values(document)),
+            )
+            self.conn.execute("DELETE FROM documents WHERE id = ?", (document["id"],))
+
+    # UIDVALIDITY 和上次不一样时清掉这个邮箱的旧索引
+    def _check_uidvalidity_locked(self, account, mailbox, uidvalidity):
+        row = self.conn.execute(
+            "SELECT uidvalidity FROM mailboxes WHERE account = ? AND mailbox = ?", (account, mailbox)
+        ).fetchone()
+        if row and row[0] == uidvalidity:
+            return
+        stale = self.conn.execute(
+            f"SELECT id, {', '.join(_STORED_FIELDS)} FROM documents "
+            "WHERE account = ? AND mailbox = ? AND uidvalidity != ?",
+            (account, mailbox, uidvalidity),
+        ).fetchall()
+        self._delete_locked(stale)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO mailboxes (account, mailbox, uidvalidity) VALUES (?, ?, ?)",
+            (account, mailbox, uidvalidity),
+        )
+
+    # 写入或更新一批邮件，内容没有变化的跳过；documents 是包含 DOCUMENT_FIELDS 的字典列表
+    def add_many(self, documents):
+        with self.lock:
+            checked = set()
+            for document in documents:
+                mailbox_key = (document["account"], document["mailbox"], document["uidvalidity"])
+                if mailbox_key not in checked:
+                    checked.add(mailbox_key)
+                    self._check_uidvalidity_locked(*mailbox_key)
+
+                values = tuple(document[field] or "" for field in _STORED_FIELDS)
+                row = self.conn.execute(
+                    f"SELECT id, {', '.join(_STORED_FIELDS)} FROM documents "
+                    "WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid = ?",
+                    (*mailbox_key, int(document["uid"])),
+                ).fetchone()
+                if row is not None:
+                    if tuple(row[1:]) == values:
+                        continue
+                    self._delete_locked([row])
+
+                cursor = self.conn.execute(
+                    f"INSERT INTO documents ({', '.join(DOCUMENT_FIELDS)}) "
+                    f"VALUES ({', '.join('?' * len(DOCUMENT_FIELDS))})",
+                    (*mailbox_key, int(document["uid"]), *values),
+                )
+                self.conn.execute(
+                    "INSERT INTO documents_fts (rowid, subject, sender, body, summary, schedule) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (cursor.lastrowid, *_fts_values(dict(zip(_STORED_FIELDS, values)))),
+                )
+            self.conn.commit()
+
+    # 按相关度返回最多 limit 封匹配的邮件，每封是一个字典（除正文外的 DOCUMENT_FIELDS）
+    # 匹配很多时只在最近写入的 RANK_CANDIDATES 个里排序，FTS5 按 rowid 倒序取前几个不用扫描全部匹配
+    def search(self, text, limit=200):
+        query = build_query(text)
+        if not query:
+            return []
+        fields = [field for field in DOCUMENT_FIELDS if field != "body"]
+        with self.lock:
+            candidates = self.conn.execute(
+                f"SELECT rowid, bm25(documents_fts, {', '.join(map(str, _COLUMN_WEIGHTS))}) FROM documents_fts "
+                "WHERE documents_fts MATCH ? ORDER BY rowid DESC LIMIT ?",
+                (query, max(limit, RANK_CANDIDATES)),
+            ).fetchall()
+            # bm25 越小越相关
+            ids = [rowid for rowid, _ in sorted(candidates, key=lambda candidate: candidate[1])[:limit]]
+            rows = {}
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                for row in self.conn.execute(
+                    f"SELECT id, {', '.join(fields)} FROM documents WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ):
+                    rows[row[0]] = dict(zip(fields, row[1:]))
+        return [rows[rowid] for rowid in ids if rowid in rows]
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,27 @@
+import os
+import sys
+import time
+
+# 启动耗时统计：设置环境变量 MAIL_ASSISTANT_TIMING=1 或者加 --timing 参数运行时，
+# 窗口出现后在标准错误打印启动的每一步用了多少毫秒，用来发现启动变慢的改动
+# 具体是哪个模块导入慢，可以再用 python -X importtime main.py 查看
+
+ENABLED = os.environ.get("MAIL_ASSISTANT_TIMING") == "1" or "--timing" in sys.argv
+
+_start = time.perf_counter()
+_marks = []
+
+
+# 记录一个时间点，name 描述从上一个时间点到现在做了什么
+def mark(name):
+    _marks.append((name, time.perf_counter()))
+
+def report(file=None):
+    if not ENABLED:
+        return
+    file = file or sys.stderr
+    print("startup timing (ms):      step     total", file=file)
+    previous = _start
+    for name, at in _marks:
+        print(f"  {name:<20}{(at - previous) * 1000:10.1f}{(at - _start) * 1000:10.1f}", file=file)
+        previous = at
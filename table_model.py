@@ -0,0 +1,53 @@
+# 邮件表格的数据部分，不依赖 tkinter：所有行按插入顺序保存在列表里，显示顺序是一个行号列表
+#
+# 每行插入时用 sort_keys(值元组) 算好各列的排序键，排序只是重新排列行号；
+# 每列排好的顺序会缓存起来，插入新行之前反复点同一列表头不用重新排序
+
+
+class TableModel:
+    def __init__(self, columns, sort_keys=None):
+        self.columns = columns
+        self.sort_keys = sort_keys or (lambda values: values)
+        self.clear()
+
+    def __len__(self):
+        return len(self.order)
+
+    def clear(self):
+        # 全部行 [(值元组, 标签)]；keys[i] 是第 i 行各列的排序键
+        self.rows = []
+        self.keys = []
+        # 显示顺序（行号列表），以及每列升序排好的行号 {列序号: 行号列表}
+        self.order = []
+        self.sorted_orders = {}
+
+    # 在最前面插入一批行，rows 里越靠后的越新，显示在越上面；返回这些行的行号
+    def insert_rows(self, rows):
+        first = len(self.rows)
+        for values, tag in rows:
+            self.rows.append((values, tag))
+            self.keys.append(self.sort_keys(values))
+        self.order[:0] = range(len(self.rows) - 1, first - 1, -1)
+        self.sorted_orders = {}
+        return range(first, len(self.rows))
+
+    # 原地修改一些行的值和标签 {行号: (值元组, 标签)}，显示位置不变，重新点表头排序时才按新值排
+    def update_rows(self, updates):
+        for index, (values, tag) in updates.items():
+            self.rows[index] = (values, tag)
+            self.keys[index] = self.sort_keys(values)
+        if updates:
+            self.sorted_orders = {}
+
+    # 按某一列重新排列所有行
+    def sort(self, column, reverse=False):
+        index = self.columns.index(column)
+        ascending = self.sorted_orders.get(index)
+        if ascending is None:
+            keys = self.keys
+            ascending = self.sorted_orders[index] = sorted(range(len(keys)), key=lambda i: keys[i][index])
+        self.order = ascending[::-1] if reverse else list(ascending)
+
+    # 显示顺序里从 offset 开始的 count 行
+    def window(self, offset, count):
+        return [self.rows[i] for i in self.order[offset:offset + count]]
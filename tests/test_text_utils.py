@@ -0,0 +1,45 @@
+import unittest
+
+from text_utils import clean_content, html_to_text
+
+
+# 页脚只去掉末尾的部分，不能把只有一段的通知整个删掉
+class CleanContentFooterTest(unittest.TestCase):
+    def test_single_paragraph_notice_is_kept(self):
+        text = "关于图书馆明日闭馆的通知：因设备检修，图书馆明日闭馆一天。此邮件为系统自动发送，请勿直接回复。"
+        self.assertEqual(clean_content(text), text)
+
+    def test_trailing_footer_line_is_removed(self):
+        text = "The exam has been moved to Friday.\nTo unsubscribe click here."
+        self.assertEqual(clean_content(text), "The exam has been moved to Friday.")
+
+    def test_html_lines_joined_by_br(self):
+        html = "<div>本周讲座预告<br>周三 张教授：大模型<br>周五 李教授：编译器<br>如需退订请点击这里</div>"
+        self.assertEqual(clean_content(html_to_text(html)), "本周讲座预告\n周三 张教授：大模型\n周五 李教授：编译器")
+
+    def test_trailing_disclaimer_paragraph_is_removed(self):
+        text = ("Dear all,\n\nThe exam is moved.\n\n"
+                "This email is confidential and intended only for the recipient.\nIf you received it in error, delete it.")
+        self.assertEqual(clean_content(text), "Dear all,\n\nThe exam is moved.")
+
+    def test_footer_keyword_in_the_middle_is_kept(self):
+        text = "如何退订校园通知：在门户网站设置中关闭。\n\n下周一起生效。"
+        self.assertEqual(clean_content(text), text)
+
+    def test_footer_only_message_is_kept(self):
+        text = "此邮件为系统自动发送，请勿直接回复。"
+        self.assertEqual(clean_content(text), text)
+
+
+# 只有 "-- " 是签名分隔线，单独的 "--" 是普通分隔线，后面的内容要保留
+class CleanContentSignatureTest(unittest.TestCase):
+    def test_bare_dashes_separator_is_kept(self):
+        text = "会议通知\n--\n时间：周五下午3点"
+        self.assertEqual(clean_content(text), text)
+
+    def test_signature_is_removed(self):
+        self.assertEqual(clean_content("正文内容\n\n-- \n张三\n电话 123"), "正文内容")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import re
+from html import unescape
+from html.parser import HTMLParser
+
+# 正文清理：HTML 转文本、去掉引用的历史邮件、签名、页脚和免责声明，并按 token 预算截断
+
+
+# 粗略估计 token 数：中日韩字符大约一个字一个 token，其他字符大约四个一个 token
+def _is_cjk(char):
+    return '⺀' <= char <= '鿿' or '豈' <= char <= '﫿'
+
+def estimate_tokens(text):
+    cjk = sum(1 for char in text if _is_cjk(char))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+_BLOCK_TAGS = {"p", "div", "br", "tr", "li", "h1", "h2", "h3", "h4", "h5", "h6", "table", "section", "article", "hr"}
+_SKIP_TAGS = {"script", "style", "head", "title"}
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+# HTML 转纯文本，只保留文字和段落换行
+def html_to_text(html):
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+        text = "".join(parser.parts)
+    except Exception:
+        # 极端畸形的 HTML，退化成直接去标签
+        text = unescape(re.sub(r'<[^>]+>', ' ', html))
+    text = re.sub(r'[ \t\r\f\v\xa0]+', ' ', text)
+    return re.sub(r'\n\s*\n\s*', '\n\n', text).strip()
+
+
+# 引用的历史邮件从这些行开始
+_QUOTE_HEADERS = re.compile(
+    r'^\s*(-{2,}\s*(original message|forwarded message|原始邮件|转发邮件)\s*-{2,}'
+    r'|on .{0,200} wrote:\s*$'
+    r'|在\s*.{0,200}写道\s*[:：]\s*$'
+    r'|_{10,}\s*$)',
+    re.IGNORECASE,
+)
+# 引用标记之前至少有这么多字才算是回复，否则（例如直接转发的通知）引用部分就是正文，需要保留
+MIN_REPLY_CHARS = 20
+# 签名分隔线 "-- "（两个减号加一个空格），单独的 "--" 常用作普通分隔线，不算签名
+_SIGNATURE = re.compile(r'^-- $')
+# 含有这些词的行视为页脚或免责声明
+_FOOTER_KEYWORDS = re.compile(
+    r'unsubscribe|退订|取消订阅|this (e-?mail|message) (and any attachments )?(is|are|may contain) confidential'
+    r'|免责声明|本邮件.{0,20}(保密|机密)|请勿直接回复|此邮件为系统自动发送|sent from my (iphone|ipad|android)',
+    re.IGNORECASE,
+)
+
+# 去掉末尾的页脚：最后一段以页脚行开头时整段去掉，否则只去掉这一段末尾的页脚行；
+# 页脚只在末尾，正文中间提到“退订”的段落保留；全部内容都像页脚时（例如一句话的系统通知）原样保留
+def _strip_footer(paragraphs):
+    paragraphs = [paragraph.split('\n') for paragraph in paragraphs]
+    while len(paragraphs) > 1 and _FOOTER_KEYWORDS.search(paragraphs[-1][0]):
+        paragraphs.pop()
+    last = paragraphs[-1] if paragraphs else []
+    while len(last) > 1 and _FOOTER_KEYWORDS.search(last[-1]):
+        last.pop()
+    return ['\n'.join(lines).strip() for lines in paragraphs]
+
+# 去掉引用的历史邮件、签名、页脚、免责声明和重复段落
+def clean_content(text):
+    lines = []
+    for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+        if _SIGNATURE.match(line):
+            break
+        if line.strip().startswith('>'):
+            continue
+        if _QUOTE_HEADERS.match(line):
+            if len(re.sub(r'\s', '', ''.join(lines))) >= MIN_REPLY_CHARS:
+                break
+            continue
+        lines.append(line.rstrip())
+
+    paragraphs = []
+    seen = set()
+    for paragraph in re.split(r'\n\s*\n', '\n'.join(lines)):
+        paragraph = paragraph.strip()
+        key = re.sub(r'\s+', ' ', paragraph)
+        if not paragraph or key in seen:
+            continue
+        seen.add(key)
+        paragraphs.append(paragraph)
+    return '\n\n'.join(_strip_footer(paragraphs))
+
+TRUNCATED_MARK = "……（内容已截断）"
+
+# 按估计的 token 数截断，budget 为 0 时不截断
+def truncate_to_tokens(text, budget):
+    if not budget or estimate_tokens(text) <= budget:
+        return text
+
+    used = 0.0
+    for i, char in enumerate(text):
+        used += 1 if _is_cjk(char) else 0.25
+        if used > budget:
+            return text[:i].rstrip() + TRUNCATED_MARK
+    return text
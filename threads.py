@@ -0,0 +1,147 @@
+import asyncio
+import re
+import threading
+import weakref
+
+from mail_cache import normalize_subject
+
+# 邮件会话：按 Message-ID / In-Reply-To / References 把回复链归到同一个会话，没有这些头的回复按去掉 Re/Fwd 前缀的主题归组
+#
+# - 会话 id 是会话第一封邮件的 Message-ID（References 里的第一个），没有时用 "subject:规范化主题"
+# - 一个会话只分类一次：同一次加载里的几封邮件合并成一行，以最新的一封为代表；之后有新回复时
+#   只把新邮件和会话上次的分类结果交给模型更新（见 main.thread_content），不用重新发送整个会话
+# - 会话的归属和上次的分类结果保存在本地缓存里（开启 [CACHE] 时），重启之后也能接着增量更新
+
+_MESSAGE_ID = re.compile(r'<[^<>\s]+>')
+_REPLY_PREFIX = re.compile(r'^\s*(re|fw|fwd|回复|答复|转发)\s*[:：]', re.IGNORECASE)
+
+
+# 头字段里的 Message-ID 列表，按出现顺序
+def message_ids(value):
+    return _MESSAGE_ID.findall(value or "")
+
+def _subject_key(subject):
+    normalized = normalize_subject(subject)
+    return f"subject:{normalized}" if normalized else None
+
+# 会话里用来区分邮件的键：Message-ID，没有时用账号、文件夹和 UID
+def member_key(record):
+    return record["headers"].get("Message-ID") or f"{record['account']}/{record['mailbox']}/{record['uid']}"
+
+# 一行（会话代表）包含的所有邮件记录，不分组时就是它自己
+def thread_records(record):
+    return record.get("thread_records") or [record]
+
+# 把已经标好 "thread" 的记录按会话合并，每个会话返回最新的一封作为代表，thread_records 是会话里从早到晚的记录
+def group_threads(records):
+    groups = {}
+    representatives = []
+    for record in records:
+        thread = record.get("thread")
+        if thread is None:
+            representatives.append(record)
+        elif thread in groups:
+            groups[thread].append(record)
+        else:
+            groups[thread] = [record]
+            # 先占住位置，保持会话第一次出现的顺序
+            representatives.append(thread)
+
+    result = []
+    for item in representatives:
+        if isinstance(item, str):
+            group = sorted(groups[item], key=lambda record: (record["headers"].get("日期", ""), record["uid"]))
+            item = group[-1]
+            item["thread_records"] = group
+        result.append(item)
+    return result
+
+
+class ThreadIndex:
+    def __init__(self):
+        # 拉取线程里标记会话，事件循环线程里读写会话状态
+        self.lock = threading.Lock()
+        self.ids = {}
+        self.states = {}
+        self.locks = weakref.WeakValueDictionary()
+
+    def _lookup(self, keys, cache):
+        with self.lock:
+            found = {key: self.ids[key] for key in keys if key in self.ids}
+        missing = [key for key in keys if key not in found]
+        if cache and missing:
+            stored = cache.get_thread_ids(missing)
+            with self.lock:
+                self.ids.update(stored)
+            found.update(stored)
+        return found
+
+    # 给每条记录标上所属会话 record["thread"]，没有 Message-ID 也不是回复的邮件为 None
+    def assign(self, records, cache=None):
+        # 从早到晚处理，会话的第一封先登记主题，同一块里丢了 References 的回复才能找到它
+        ordered = sorted(records, key=lambda record: (record["headers"].get("日期", ""), record["uid"]))
+        keys_by_record = []
+        for record in ordered:
+            headers = record["headers"]
+            own = headers.get("Message-ID", "").strip()
+            references = message_ids(headers.get("References", ""))
+            references += [key for key in message_ids(headers.get("In-Reply-To", "")) if key not in references]
+            subject_key = _subject_key(headers.get("主题", ""))
+            keys_by_record.append((own, references, subject_key))
+
+        lookup = {key for own, references, subject_key in keys_by_record
+                  for key in references + [own, subject_key] if key}
+        known = self._lookup(lookup, cache)
+
+        new_ids = {}
+        for record, (own, references, subject_key) in zip(ordered, keys_by_record):
+            is_reply = bool(references) or bool(_REPLY_PREFIX.match(record["headers"].get("主题", "")))
+            keys = [key for key in references + [own] if key]
+            # 没有 References / In-Reply-To 的回复才按主题归组
+            candidates = keys + ([subject_key] if is_reply and not references and subject_key else [])
+            thread = next((known[key] for key in candidates if key in known), None)
+            if thread is None:
+                thread = references[0] if references else (subject_key if is_reply and subject_key else own or None)
+            record["thread"] = thread
+            if thread is None:
+                continue
+
+            # 会话的第一封邮件登记主题，之后丢了 References 的回复也能找到它
+            for key in candidates + ([subject_key] if subject_key and not is_reply else []):
+                if key not in known:
+                    known[key] = new_ids[key] = thread
+
+        if new_ids:
+            with self.lock:
+                for key, thread in new_ids.items():
+                    self.ids.setdefault(key, thread)
+            if cache:
+                cache.save_thread_ids(new_ids)
+        return records
+
+    # 会话上次的状态 {"classification", "members", "last_date"}，members 是已经分类过的邮件的键
+    def state(self, thread, cache=None):
+        with self.lock:
+            state = self.states.get(thread)
+        if state is None and cache:
+            state = cache.get_thread(thread)
+            if state is not None:
+                state["members"] = set(state["members"])
+                with self.lock:
+                    self.states[thread] = state
+        return state
+
+    def save(self, thread, classification, members, last_date, cache=None):
+        state = {"classification": classification, "members": set(members), "last_date": last_date}
+        with self.lock:
+            self.states[thread] = state
+        if cache:
+            cache.save_thread(thread, classification, members, last_date)
+        return state
+
+    # 同一个会话的分类一次只进行一个，后到的回复等前一个完成后在它的结果上增量更新
+    def lock_for(self, thread):
+        lock = self.locks.get(thread)
+        if lock is None:
+            lock = self.locks[thread] = asyncio.Lock()
+        return lock